@@ -0,0 +1,24 @@
+"""
+@file common.py
+@brief Reporting helpers shared by the benchmarks
+"""
+
+
+def percentile(samples, fraction):
+    """Returns the sample at fraction of the sorted samples, 0 if there are none"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def report(name, line, **extra):
+    """Print one benchmark line
+        :param name: case name
+        :param line: measurements following the name
+        :param extra: further key value pairs appended to the line
+    """
+    line = f"{name:<12} {line}"
+    for key, value in extra.items():
+        line += f"  {key} {value}"
+    print(line)
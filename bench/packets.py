@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+@file packets.py
+@brief Micro-benchmark for Gov packet encoding
+    python -m bench.packets
+"""
+import argparse
+import random
+import time
+
+from govle import gov
+
+
+def run(name, build, count):
+    """Time count calls of build and print packets per second"""
+    start = time.perf_counter()
+    for i in range(count):
+        build(i).get_payload()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<16} {count / elapsed:>12,.0f} packets/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="govle packet encoding benchmark")
+    parser.add_argument('-n', "--count", help="Packets per case", type=int, default=100000)
+    args = parser.parse_args()
+
+    builder = gov.Gov()
+    colors = [tuple(random.randrange(256) for _ in range(3)) for _ in range(64)]
+
+    run("power", lambda i: builder.set_power(i & 1 == 0), args.count)
+    run("brightness", lambda i: builder.set_brightness(i & 0xFF), args.count)
+    run("keep_alive", lambda i: builder.keep_alive(), args.count)
+    run("manual_color", lambda i: builder.set_manual_color(colors[i & 63]), args.count)
+    run("segment_color", lambda i: builder.set_segment_color(colors[i & 63], gov.bitmask_to_segment(1 << (i & 15))), args.count)
+    run("random_color", lambda i: builder.set_manual_color((i & 0xFF, (i >> 8) & 0xFF, (i >> 16) & 0xFF)), args.count)
+
+
+if __name__ == "__main__":
+    main()
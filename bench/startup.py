@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+@file startup.py
+@brief CLI startup benchmarks, each run in a fresh interpreter
+    python -m bench.startup
+
+    help     main.py --help until exit
+    imports  import time of main.py's top level imports, from -X importtime
+    first    main.py <device> -o on --sim until the first packet is traced
+    daemon   main.py <device> -o on against a running simulated govled
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench import common
+from bench.common import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, "main.py")
+DAEMON = os.path.join(ROOT, "govled.py")
+# Modules a CLI call should not import unless it needs them
+HEAVY = ("bleak", "quart", "numpy")
+
+
+def report(name, samples, **extra):
+    """Print one timing line"""
+    common.report(name, f"p50 {percentile(samples, 0.5) * 1000:>8.1f} ms  p90 {percentile(samples, 0.9) * 1000:>8.1f} ms",
+                  **extra)
+
+
+def run(argv, cwd):
+    """Run a command to completion and return its wall time"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + argv, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+    return time.perf_counter() - start
+
+
+def bench_help(args, cwd):
+    report("help", [run([MAIN, "--help"], cwd) for _ in range(args.runs)])
+
+
+def bench_imports(args, cwd):
+    totals = []
+    modules = {}
+    for _ in range(args.runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", MAIN, "--help"], cwd=cwd,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=False)
+        total = 0
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                modules[name.strip()] = int(cumulative)
+                # Only top level imports, nested ones are in their parent's time
+                if not name.startswith("  "):
+                    total += int(cumulative)
+        totals.append(total / 1e6)
+    heavy = [name for name in HEAVY if name in modules]
+    report("imports", totals, heavy=",".join(heavy) or "none")
+    for name, us in sorted(modules.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"    {name:<32} {us / 1000:>8.1f} ms")
+
+
+def first_packet(argv, cwd):
+    """Run a traced command and return seconds until its first packet line"""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable] + argv, cwd=cwd, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, text=True)
+    elapsed = None
+    for line in process.stdout:
+        if elapsed is None and ">>#" in line:
+            elapsed = time.perf_counter() - start
+    process.wait()
+    if elapsed is None:
+        raise RuntimeError(f"no packet traced by {' '.join(argv)}")
+    return elapsed
+
+
+def bench_first(args, cwd):
+    argv = [MAIN, args.device, "-o", "on", "--sim", "--trace", "1"]
+    report("first", [first_packet(argv, cwd) for _ in range(args.runs)])
+
+
+def bench_daemon(args, cwd):
+    socket = os.path.join(cwd, "govle.sock")
+    daemon = subprocess.Popen([sys.executable, DAEMON, "--sim", "--socket", socket], cwd=cwd,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while not os.path.exists(socket):
+            if daemon.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError("govled did not start")
+            time.sleep(0.05)
+        report("daemon", [run([MAIN, args.device, "-o", "on", "--socket", socket], cwd) for _ in range(args.runs)])
+    finally:
+        daemon.terminate()
+        daemon.wait()
+
+
+CASES = {
+    "help": bench_help,
+    "imports": bench_imports,
+    "first": bench_first,
+    "daemon": bench_daemon,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="govle CLI startup benchmarks")
+    parser.add_argument("cases", nargs="*", help="Cases to run", default=list(CASES.keys()))
+    parser.add_argument('-n', "--runs", help="Runs per case", type=int, default=10)
+    parser.add_argument("--device", help="Configured device to address", default="office")
+    parser.add_argument("--top", help="Slowest imports to list", type=int, default=8)
+    args = parser.parse_args()
+
+    # Runs write their log and state files here instead of the checkout
+    with tempfile.TemporaryDirectory() as cwd:
+        for case in args.cases:
+            CASES[case](args, cwd)
+
+
+if __name__ == "__main__":
+    main()
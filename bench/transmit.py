@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+@file transmit.py
+@brief Transmit path benchmarks against the simulated H6127
+    python -m bench.transmit
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+from bench import common
+from bench.common import percentile
+from govle import gov, govle, metrics, sim, throttle
+from govle.logging import logger
+
+BACKGROUND = (255, 255, 255)
+SPOT = (0, 255, 0)
+
+
+def report(name, count, elapsed, latencies=(), **extra):
+    """Print one throughput line"""
+    line = f"{count / elapsed:>10,.0f} pkt/s"
+    if latencies:
+        line += f"  p50 {percentile(latencies, 0.5) * 1000:>8.2f} ms  p99 {percentile(latencies, 0.99) * 1000:>8.2f} ms"
+    common.report(name, line, **extra)
+
+
+async def timed_write(le, packet, coalesce):
+    """Write packet and return (enqueue to ack seconds, success)"""
+    start = time.perf_counter()
+    success = await le.write(packet, coalesce=coalesce, wait=True)
+    return time.perf_counter() - start, success
+
+
+def simulated(args, address, net):
+    """Create a Govle on net using the command line flow options"""
+    window = throttle.AdaptiveWindow() if args.pipeline else None
+    return govle.Govle(address, transport_factory=net, window=window)
+
+
+def network(args, **overrides):
+    """Create a SimNetwork from the command line link options"""
+    options = dict(latency=args.latency, jitter=args.jitter, drop_rate=args.drop_rate,
+                   disconnect_rate=args.disconnect_rate, connect_latency=args.connect_latency,
+                   idle_timeout=args.idle_timeout, seed=1)
+    options.update(overrides)
+    return sim.SimNetwork(**options)
+
+
+async def bench_queue(args):
+    """Distinct packets that can not be coalesced"""
+    net = network(args)
+    async with simulated(args, "SIM:QUEUE", net) as gle:
+        packets = [gle.gov.set_segment_color((i & 0xFF, (i >> 8) & 0xFF, 0), gov.bitmask_to_segment(1 << (i % 16)))
+                   for i in range(args.count)]
+        start = time.perf_counter()
+        results = await asyncio.gather(*[timed_write(gle.le, p, False) for p in packets])
+        elapsed = time.perf_counter() - start
+    report("queue", args.count, elapsed, [r[0] for r in results],
+           failed=sum(1 for r in results if not r[1]))
+
+
+async def bench_coalesce(args):
+    """Brightness ramp where only the final level matters"""
+    for coalesce in (False, True):
+        net = network(args)
+        async with simulated(args, "SIM:RAMP", net) as gle:
+            packets = [gle.gov.set_brightness(i & 0xFF) for i in range(args.count)]
+            start = time.perf_counter()
+            results = await asyncio.gather(*[timed_write(gle.le, p, coalesce) for p in packets])
+            elapsed = time.perf_counter() - start
+        device = net.devices["SIM:RAMP"]
+        report("coalesce" if coalesce else "no-coalesce", args.count, elapsed, [r[0] for r in results],
+               on_air=device.received - device.keep_alives)
+
+
+def spot_frames(laps):
+    """A single spot running around the strip laps times"""
+    for _ in range(laps):
+        for bit in range(gov.SEGMENT_COUNT):
+            frame = [BACKGROUND] * gov.SEGMENT_COUNT
+            frame[bit] = SPOT
+            yield frame
+
+
+async def bench_animation(args):
+    """Moving spot animation at a target rate"""
+    net = network(args)
+    async with simulated(args, "SIM:ANIM", net) as gle:
+        start = time.perf_counter()
+        animator = await gle.animate(spot_frames(10), args.fps)
+        elapsed = time.perf_counter() - start
+    device = net.devices["SIM:ANIM"]
+    report("animation", device.received, elapsed, fps=f"{animator.achieved_fps:.1f}/{args.fps}",
+           sent=animator.sent, dropped=animator.dropped)
+
+
+async def bench_reconnect(args):
+    """Connect cost and throughput on a link that keeps dropping"""
+    net = network(args, disconnect_rate=max(args.disconnect_rate, 0.02))
+    costs = []
+    for _ in range(10):
+        start = time.perf_counter()
+        gle = await simulated(args, "SIM:RECONNECT", net).open()
+        costs.append(time.perf_counter() - start)
+        await gle.close()
+    # A flaky link is slow, keep the packet count bounded
+    count = min(args.count, 200)
+    gle = await simulated(args, "SIM:RECONNECT", net).open()
+    connects = net.connects
+    packets = [gle.gov.set_segment_color((i & 0xFF, 0, 0), gov.bitmask_to_segment(1 << (i % 16)))
+               for i in range(count)]
+    start = time.perf_counter()
+    results = await asyncio.gather(*[timed_write(gle.le, p, False) for p in packets])
+    elapsed = time.perf_counter() - start
+    await gle.close()
+    report("reconnect", count, elapsed, [r[0] for r in results],
+           connect_p50=f"{percentile(costs, 0.5) * 1000:.2f}ms", reconnects=net.connects - connects)
+
+async def bench_pipeline(args):
+    """The same animation acknowledged and pipelined, as fast as the link goes"""
+    rates = {}
+    for pipeline in (False, True):
+        net = network(args)
+        window = throttle.AdaptiveWindow() if pipeline else None
+        async with govle.Govle("SIM:PIPE", transport_factory=net, window=window) as gle:
+            frames = list(spot_frames(10))
+            start = time.perf_counter()
+            animator = await gle.animate(frames)
+            elapsed = time.perf_counter() - start
+        device = net.devices["SIM:PIPE"]
+        rates[pipeline] = animator.sent / elapsed
+        wrong = sum(1 for shown, wanted in zip(device.segments, frames[-1]) if shown != wanted)
+        report("pipelined" if pipeline else "acked", device.received, elapsed, fps=f"{rates[pipeline]:.1f}",
+               queries=device.queries, wrong=wrong)
+    print(f"{'speedup':<12} {rates[True] / rates[False]:>10.1f}x")
+
+CASES = {
+    "queue": bench_queue,
+    "coalesce": bench_coalesce,
+    "animation": bench_animation,
+    "reconnect": bench_reconnect,
+    "pipeline": bench_pipeline,
+}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="govle transmit benchmarks on a simulated device")
+    parser.add_argument("cases", nargs="*", help="Cases to run", default=list(CASES.keys()))
+    parser.add_argument('-n', "--count", help="Packets per case", type=int, default=500)
+    parser.add_argument("--latency", help="Seconds per acknowledged write", type=float, default=0.001)
+    parser.add_argument("--jitter", help="Random extra seconds per write", type=float, default=0.0005)
+    parser.add_argument("--drop-rate", help="Probability a write fails", type=float, default=0.0)
+    parser.add_argument("--disconnect-rate", help="Probability a write drops the link", type=float, default=0.0)
+    parser.add_argument("--connect-latency", help="Seconds per connect", type=float, default=0.05)
+    parser.add_argument("--idle-timeout", help="Seconds of silence before the link drops", type=float)
+    parser.add_argument("--fps", help="Animation target frames per second", type=float, default=100)
+    parser.add_argument("--pipeline", help="Pipeline writes without response", action="store_true")
+    parser.add_argument("--metrics", help="Collect transmit metrics while running", action="store_true")
+    args = parser.parse_args()
+
+    logger.setLevel(logging.CRITICAL)
+    metrics.REGISTRY.enable(args.metrics)
+    for case in args.cases:
+        await CASES[case](args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,8 +1,19 @@
 # Add your devices by name and BLE address
-# To find your device use hcitool:
-#   sudo hcitool lescan
-# 4B:41:C3:FB:2D:3E (unknown)
-# 4B:41:C3:FB:56:DD ihoment_H6127_56DD <-- THIS ONE
+# To find your device run a discovery scan, found strips are remembered in
+# govle_devices.json:
+#   ./main.py office -o discover
+#   4B:41:C3:FB:56:DD ihoment_H6127_56DD rssi=-60 <-- THIS ONE
+# Instead of an address a device may name a discovered strip by its
+# advertised name or suffix, e.g. "ihoment_H6127_56DD" or "56DD".
 devices = {
     "office": ""
-}
\ No newline at end of file
+}
+
+# Optional named groups of devices that are driven together
+groups = {
+    "all": list(devices.keys())
+}
+
+# Seconds between background discovery scans in the daemon and web server,
+# None to only scan on request
+scan_interval = 60
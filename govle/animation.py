@@ -0,0 +1,91 @@
+"""
+@file animation.py
+@brief Deadline driven frame scheduler
+"""
+import asyncio
+import time
+
+from govle.logging import logger
+
+
+class Animator(object):
+    """Plays segment frames on a Govle against a monotonic clock
+        animator = Animator(gle, fps=10)
+        await animator.play(frames)
+
+    Frame i is due at start + i / fps. Each frame is sent with show_frame and
+    the animator waits until the Le reports it transmitted, so the queue never
+    holds more than one frame. On a pipelined link that is when the frame was
+    written, confirming the window does not hold up the next frame. A frame whose successor is already due by the
+    time the link is free is dropped, either here or by the scheduler when
+    other traffic held it back; because show_frame only sends what differs
+    from the strip, dropped frames merge into the next one sent. The final
+    frame is always shown.
+    """
+
+    def __init__(self, gle, fps=None):
+        """Create a new animator
+            :param gle: open Govle to draw on
+            :param fps: target frames per second, None to go as fast as the link
+        """
+        self.gle = gle
+        self.fps = fps
+        self.sent = 0
+        self.dropped = 0
+        self.__started = None
+        self.__finished = None
+
+    @property
+    def achieved_fps(self) -> float:
+        """Returns frames actually transmitted per second"""
+        if self.__started is None:
+            return 0.0
+        elapsed = (self.__finished or time.monotonic()) - self.__started
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+    async def play(self, frames) -> None:
+        """Show frames, dropping those that missed their deadline
+            :param frames: iterable of 16 RGB tuple frames
+        """
+        period = 1 / self.fps if self.fps else 0
+        start = time.monotonic()
+        if self.__started is None:
+            self.__started = start
+        self.__finished = None
+        late = None
+        index = -1
+        for index, frame in enumerate(frames):
+            deadline = start + index * period
+            now = time.monotonic()
+            if period and now >= deadline + period:
+                # The next frame is already due, this one would only add lag
+                self.dropped += 1
+                late = frame
+                continue
+            late = None
+            if now < deadline:
+                await asyncio.sleep(deadline - now)
+            if not await self.__show(frame, deadline + period if period else None):
+                late = frame
+
+        if late is not None:
+            self.dropped -= 1
+            await self.__show(late)
+
+        # Hold the last frame for its full period so consecutive plays keep time
+        remaining = start + (index + 1) * period - time.monotonic()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+        self.__finished = time.monotonic()
+        logger.debug(f"animation sent {self.sent} dropped {self.dropped} at {self.achieved_fps:.1f} fps")
+
+    async def __show(self, frame, expires=None):
+        """Send frame and wait for the link to transmit it
+            :param expires: optional time.monotonic() the frame is useless after
+            :return bool True if the frame was sent
+        """
+        if await self.gle.show_frame(frame, wait=True, deadline=expires, written=True):
+            self.sent += 1
+            return True
+        self.dropped += 1
+        return False
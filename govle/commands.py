@@ -0,0 +1,69 @@
+"""
+@file commands.py
+@brief Named operations shared by the CLI and the daemon
+"""
+from govle import color
+
+OPERATIONS = ("discover", "on", "off", "gradient-on", "gradient-off", "brightness", "color", "slide", "rainbow", "diy", "all",
+              "replay", "music")
+
+
+def validate(operation, level=None, rgb=None, path=None):
+    """Check operation arguments
+        :return str error message, or None if the arguments are usable
+    """
+    if operation not in OPERATIONS:
+        return f"unknown operation '{operation}'"
+    elif operation == "brightness" and level is None:
+        return "brightness operation requires --level parameter"
+    elif operation == "color" and rgb is None:
+        return "color operation requires --rgb parameter"
+    elif operation == "replay" and path is None:
+        return "replay operation requires --scene parameter"
+    elif operation == "music" and path is None:
+        return "music operation requires --audio parameter"
+    return None
+
+
+async def run(gle, operation, level=None, rgb=None, back=None, spot=None, path=None):
+    """Run one operation against an open Govle
+        :param back: background color for effects, random if not set
+        :param spot: spot color for effects, random if not set
+        :param path: scene file for replay, WAV file for music
+        :return bool transmit success for single packet operations
+    """
+    if back is None or spot is None:
+        back, spot = color.get_random_complementary_pair()
+
+    if operation == "on":
+        return await gle.set_power(True, wait=True)
+    elif operation == "off":
+        return await gle.set_power(False, wait=True)
+    elif operation == "gradient-on":
+        return await gle.set_gradient(True, wait=True)
+    elif operation == "gradient-off":
+        return await gle.set_gradient(False, wait=True)
+    elif operation == "brightness":
+        return await gle.set_brightness(level, wait=True)
+    elif operation == "color":
+        return await gle.set_color(rgb, wait=True)
+    elif operation == "slide":
+        forward = True
+        for _ in range(5):
+            await gle.slide(back, spot, hold=0.1, forward=forward)
+            forward = not forward
+    elif operation == "rainbow":
+        await gle.rainbow()
+    elif operation == "diy":
+        await gle.diy()
+    elif operation == "all":
+        ops = [{"op": "power", "value": True}, {"op": "gradient", "value": True}, {"op": "gradient", "value": False}]
+        ops += [{"op": "brightness", "value": b} for b in range(10, 251, 10)]
+        ops += [{"op": "color", "value": color.get_random_color()} for _ in range(10)]
+        await gle.batch(ops)
+        await gle.slide(back, spot, hold=0.1)
+        await gle.set_power(False)
+    elif operation == "replay":
+        await gle.replay(path)
+    elif operation == "music":
+        await gle.music(path)
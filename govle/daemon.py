@@ -0,0 +1,207 @@
+"""
+@file daemon.py
+@brief Local control daemon holding device connections open
+
+The daemon listens on a Unix domain socket and takes one command per line,
+answering each with one line:
+
+    office on
+    office brightness 128
+    all color 255 0 0
+    office replay /home/me/sunrise.govs
+    ping
+
+    ok
+    ok {"4B:41:C3:FB:56:DD": {"success": true, "latency": 0.0123}}
+    err unknown device 'kitchen'
+
+Connections come from a DeviceManager, so only the first command for a
+device pays the BLE connect and later ones are a queue write.
+"""
+import asyncio
+import json
+import os
+import tempfile
+
+from govle import color, commands
+from govle.logging import logger
+
+GOVLE_SOCKET = os.path.join(os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir(), "govle.sock")
+GOVLE_CLIENT_TIMEOUT = 60 # seconds a client waits for a command to finish
+GOVLE_UNTIMED = ("replay", "music") # operations that last as long as their file, clients wait without a timeout
+
+
+class GovleDaemon(object):
+    """Serves commands for a DeviceManager on a Unix socket
+        daemon = GovleDaemon(manager, config.groups)
+        await daemon.start()
+        await daemon.wait_closed()
+    """
+
+    def __init__(self, manager, groups=None, path=GOVLE_SOCKET):
+        """Create a new daemon
+            :param manager: DeviceManager owning the connections
+            :param groups: optional dict of group name to member names
+            :param path: socket path
+        """
+        self.manager = manager
+        self.groups = groups or {}
+        self.path = path
+        self.__server = None
+
+    async def start(self) -> None:
+        """Start the manager and listen on the socket
+            A socket left behind by a daemon that died is replaced, a live
+            one raises RuntimeError.
+        """
+        if os.path.exists(self.path):
+            try:
+                _, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                os.unlink(self.path)
+            else:
+                writer.close()
+                raise RuntimeError(f"govle daemon already listening on {self.path}")
+
+        await self.manager.start()
+        # Create the socket private to this user, there is no window in
+        # which another user could connect before a chmod
+        umask = os.umask(0o077)
+        try:
+            self.__server = await asyncio.start_unix_server(self.__client, path=self.path)
+        finally:
+            os.umask(umask)
+        logger.info(f"daemon listening on {self.path}")
+
+    async def stop(self) -> None:
+        """Stop listening and close every device connection"""
+        if self.__server is not None:
+            self.__server.close()
+            await self.__server.wait_closed()
+            self.__server = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        await self.manager.stop()
+
+    async def wait_closed(self) -> None:
+        """Wait until the server is closed"""
+        if self.__server is not None:
+            await self.__server.wait_closed()
+
+    async def execute(self, line: str) -> str:
+        """Run one command line
+            :return str response line without the newline
+        """
+        words = line.split()
+        if not words:
+            return "err empty command"
+        if words == ["ping"]:
+            return "ok"
+        if len(words) < 2:
+            return "err expected '<device|group> <operation> [arguments]'"
+
+        name, operation, arguments = words[0], words[1], words[2:]
+        try:
+            level, rgb, path = parse_arguments(operation, arguments)
+        except ValueError as ex:
+            return f"err {ex}"
+        error = commands.validate(operation, level, rgb, path)
+        if error is None and operation == "discover":
+            error = "discover is not available through the daemon"
+        if error is not None:
+            return f"err {error}"
+
+        # Effects pick their colors once so every group member matches
+        back, spot = color.get_random_complementary_pair()
+
+        def action(gle):
+            return commands.run(gle, operation, level, rgb, back, spot, path)
+
+        try:
+            if name in self.groups:
+                grp = await self.manager.get_group(self.groups[name])
+                results = await grp.fan_out(action)
+                return "ok " + json.dumps({address: r.to_dict() for address, r in results.items()})
+            if not self.manager.is_known(name):
+                return f"err unknown device '{name}'"
+            gle = await self.manager.get(name)
+            if await action(gle) is False:
+                return "err write failed"
+            return "ok"
+        except Exception as ex:
+            logger.warning(f"daemon command '{line.strip()}' failed: {ex}")
+            return f"err {ex}"
+
+    async def __client(self, reader, writer):
+        """Answer commands from one client until it disconnects"""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self.execute(line.decode(errors="replace"))
+                writer.write(response.encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def parse_arguments(operation: str, arguments):
+    """Parse the words after an operation
+        :return (level, rgb, path) tuple, None where the operation takes none
+    """
+    level = None
+    rgb = None
+    path = None
+    if operation == "brightness" and arguments:
+        level = int(arguments[0])
+    elif operation == "color" and arguments:
+        if len(arguments) != 3:
+            raise ValueError("color expects three values, red green blue")
+        rgb = [int(c) for c in arguments]
+    elif operation in ("replay", "music") and arguments:
+        # Paths may contain spaces, the path is the rest of the line
+        path = " ".join(arguments)
+    return level, rgb, path
+
+
+def format_command(name: str, operation: str, level=None, rgb=None, path=None) -> str:
+    """Returns the command line for an operation"""
+    words = [name, operation]
+    if level is not None:
+        words.append(str(level))
+    if rgb is not None:
+        words.extend(str(c) for c in rgb)
+    if path is not None:
+        # The daemon may run in another directory
+        words.append(os.path.abspath(path))
+    return " ".join(words)
+
+
+def client_timeout(operation: str):
+    """Returns the seconds a client should wait for operation, None for no limit"""
+    return None if operation in GOVLE_UNTIMED else GOVLE_CLIENT_TIMEOUT
+
+
+async def request(line: str, path=GOVLE_SOCKET, timeout=GOVLE_CLIENT_TIMEOUT) -> str:
+    """Send one command to a running daemon
+        :param timeout: seconds to wait for the response, None for no limit
+        :return str response line
+        :raises FileNotFoundError or ConnectionRefusedError if no daemon
+                is listening on path, asyncio.TimeoutError if it did not
+                answer in time, ConnectionResetError if it hung up
+    """
+    reader, writer = await asyncio.open_unix_connection(path)
+    try:
+        writer.write(line.encode() + b"\n")
+        await writer.drain()
+        response = await asyncio.wait_for(reader.readline(), timeout)
+    finally:
+        writer.close()
+    if not response:
+        raise ConnectionResetError(f"govle daemon closed {path}")
+    return response.decode().rstrip("\n")
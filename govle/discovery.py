@@ -0,0 +1,204 @@
+"""
+@file discovery.py
+@brief Filtered BLE discovery and a persistent registry of seen strips
+
+    registry = DeviceRegistry()
+    await scan(registry)             # one blocking scan
+    registry.address_for("56DD")     # resolve without scanning
+
+    scanner = Scanner(registry)
+    scanner.start()                  # keep the registry fresh in the background
+"""
+import asyncio
+import json
+import os
+import time
+
+from govle import gov
+from govle.logging import logger
+
+GOVLE_REGISTRY_FILE = "govle_devices.json"
+GOVLE_NAME_PREFIXES = ("ihoment_", "Govee_", "GBK_")
+GOVLE_SCAN_TIMEOUT = 5.0 # seconds per scan
+GOVLE_SCAN_INTERVAL = 60.0 # seconds between background scans
+
+
+def is_govee(name, service_uuids=()) -> bool:
+    """Returns true if an advertisement looks like a Govee strip
+        :param name: advertised local name, may be None
+        :param service_uuids: advertised service UUIDs
+    """
+    if gov.GOVLE_SERVICE in (u.lower() for u in service_uuids or ()):
+        return True
+    return bool(name) and name.startswith(GOVLE_NAME_PREFIXES)
+
+
+def is_address(value: str) -> bool:
+    """Returns true if value is a BLE address, or a CoreBluetooth UUID on macOS"""
+    return ":" in value or value.count("-") == 4
+
+
+class DiscoveredDevice(object):
+    """One strip seen by a scan"""
+    __slots__ = ("name", "address", "rssi", "last_seen")
+
+    def __init__(self, name, address, rssi=None, last_seen=None):
+        self.name = name
+        self.address = address
+        self.rssi = rssi
+        self.last_seen = last_seen
+
+    def to_dict(self) -> dict:
+        """Returns a JSON friendly copy"""
+        return {"name": self.name, "address": self.address, "rssi": self.rssi, "last_seen": self.last_seen}
+
+    @classmethod
+    def from_dict(cls, entry: dict):
+        """Restore an entry saved with to_dict"""
+        return cls(entry.get("name"), entry["address"], entry.get("rssi"), entry.get("last_seen"))
+
+    def __repr__(self) -> str:
+        return f"{self.address} {self.name or '(unnamed)'} rssi={self.rssi}"
+
+
+class DeviceRegistry(object):
+    """Every strip seen so far, persisted as one JSON file"""
+
+    def __init__(self, path=GOVLE_REGISTRY_FILE):
+        self.path = path
+        self.devices = {}
+        self.load()
+
+    def load(self) -> None:
+        """Read the saved registry, a missing or corrupt file starts empty"""
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for entry in saved:
+            device = DiscoveredDevice.from_dict(entry)
+            self.devices[device.address] = device
+
+    def save(self) -> None:
+        """Write the registry, replacing the file atomically"""
+        entries = [d.to_dict() for d in self.devices.values()]
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(entries, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def update(self, name, address: str, rssi=None, seen=None) -> DiscoveredDevice:
+        """Record a sighting of address
+            :param name: advertised name, keeps the previous one if None
+            :param seen: optional time.time() of the sighting, default now
+            :return DiscoveredDevice
+        """
+        device = self.devices.get(address)
+        if device is None:
+            device = self.devices[address] = DiscoveredDevice(name, address)
+        elif name:
+            device.name = name
+        device.rssi = rssi
+        device.last_seen = seen if seen is not None else time.time()
+        return device
+
+    def find(self, name: str):
+        """Returns the most recently seen device matching name, or None
+            name may be the full advertised name (ihoment_H6127_56DD), the
+            address suffix it ends in (56DD) or an address.
+        """
+        wanted = name.lower()
+        matches = [d for d in self.devices.values()
+                   if d.address.lower() == wanted
+                   or (d.name and d.name.lower() == wanted)
+                   or (d.name and d.name.lower().endswith("_" + wanted))]
+        if not matches:
+            return None
+        return max(matches, key=lambda d: d.last_seen or 0)
+
+    def address_for(self, name: str) -> str:
+        """Returns the address for name, or name if it is not known"""
+        if is_address(name):
+            return name
+        device = self.find(name)
+        return device.address if device is not None else name
+
+    def seen_since(self, since: float):
+        """Returns devices seen at or after time.time() value since"""
+        return [d for d in self.devices.values() if (d.last_seen or 0) >= since]
+
+
+async def scan(registry=None, timeout=GOVLE_SCAN_TIMEOUT):
+    """Scan for Govee strips
+        :param registry: optional DeviceRegistry updated with every sighting
+        :param timeout: seconds to scan
+        :return list of DiscoveredDevice seen by this scan, strongest first
+    """
+    from bleak import BleakScanner
+
+    registry = registry if registry is not None else DeviceRegistry(path=os.devnull)
+    start = time.time()
+
+    def detected(device, advertisement):
+        name = advertisement.local_name or device.name
+        if is_govee(name, advertisement.service_uuids):
+            registry.update(name, device.address, advertisement.rssi)
+
+    async with BleakScanner(detected):
+        await asyncio.sleep(timeout)
+
+    found = registry.seen_since(start)
+    logger.debug(f"scan found {len(found)} strips in {timeout}s")
+    return sorted(found, key=lambda d: d.rssi if d.rssi is not None else -999, reverse=True)
+
+
+class Scanner(object):
+    """Background scanner keeping a DeviceRegistry fresh
+        Scans for timeout seconds every interval seconds and saves the
+        registry after each scan that saw something.
+    """
+
+    def __init__(self, registry: DeviceRegistry, interval=GOVLE_SCAN_INTERVAL, timeout=GOVLE_SCAN_TIMEOUT):
+        self.registry = registry
+        self.interval = interval
+        self.timeout = timeout
+        self.__task = None
+
+    @property
+    def is_running(self) -> bool:
+        return self.__task is not None and not self.__task.done()
+
+    def start(self) -> None:
+        """Start scanning in the background"""
+        if not self.is_running:
+            self.__task = asyncio.get_event_loop().create_task(self.__run())
+
+    async def stop(self) -> None:
+        """Stop scanning and save the registry"""
+        if self.__task is not None:
+            self.__task.cancel()
+            try:
+                await self.__task
+            except asyncio.CancelledError:
+                pass
+            self.__task = None
+        self.__save()
+
+    def __save(self):
+        try:
+            self.registry.save()
+        except OSError as ex:
+            logger.warning(f"failed to save device registry: {ex}")
+
+    async def __run(self):
+        while True:
+            try:
+                if await scan(self.registry, self.timeout):
+                    self.__save()
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                # No adapter or the adapter is busy, try again next interval
+                logger.warning(f"background scan failed: {ex}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,183 @@
+"""
+@file diy.py
+@brief Compiles DIY effects into packet sequences
+
+A DIY effect is uploaded as a stream of 0xA1 0x02 packets and then started
+with the DIY color command. The stream begins with a five byte header
+
+    name 0x03, style, mode 0x02, speed 0x00-0x64, color byte count
+
+followed by the palette as RGB triples, and is split into 16 byte chunks,
+one per numbered data packet:
+
+    AA 01                   keep alive
+    A1 02 00 <n>            start, n data packets follow
+    A1 02 01 <16 bytes>     data 1..n
+    A1 02 FF                end
+    33 05 0A                run the uploaded effect
+
+Compiled sequences are cached by the hash of what went into them, in memory
+and optionally on disk, so an effect is only ever encoded once.
+"""
+import hashlib
+import os
+
+from govle import gov
+from govle.logging import logger
+
+DIY_STYLES = {"fade": 0x00, "jumping": 0x01, "flicker": 0x02, "marquee": 0x03, "music": 0x04}
+DIY_SPEED_MAX = 0x64
+# The header counts color bytes in one byte
+DIY_MAX_COLORS = 0xFF // 3
+
+DIY_INDICATOR = 0xA1
+DIY_DATA = 0x02
+DIY_NAME = 0x03
+DIY_MODE = 0x02
+DIY_START = 0x00
+DIY_END = 0xFF
+DIY_RUN = 0x0A
+DIY_CHUNK = 16
+
+GOVLE_DIY_CACHE_DIR = "govle_diy"
+
+# The effect Gov.make_diys always sent before palettes were configurable
+DEFAULT_PALETTE = ((0x44, 0x0D, 0xFA), (0x0B, 0x13, 0xDE), (0x00, 0x4B, 0xF5), (0x0D, 0xD1, 0xFA)) * 2
+DEFAULT_STYLE = "marquee"
+DEFAULT_SPEED = DIY_SPEED_MAX
+
+
+def validate(palette, style, speed):
+    """Check and normalise DIY parameters
+        :return (palette, style, speed) with palette as a tuple of RGB tuples
+        :raises ValueError if any parameter is invalid
+    """
+    if style not in DIY_STYLES:
+        raise ValueError(f"unknown DIY style '{style}', expected one of {', '.join(DIY_STYLES)}")
+    if isinstance(speed, bool) or int(speed) != speed or not 0 <= speed <= DIY_SPEED_MAX:
+        raise ValueError(f"DIY speed must be 0-{DIY_SPEED_MAX}")
+    palette = tuple(tuple(rgb) for rgb in palette)
+    if not 0 < len(palette) <= DIY_MAX_COLORS:
+        raise ValueError(f"DIY palette needs 1 to {DIY_MAX_COLORS} colors")
+    for rgb in palette:
+        if len(rgb) != 3 or not all(isinstance(c, int) and 0 <= c <= 255 for c in rgb):
+            raise ValueError(f"{rgb!r} is not an RGB triple")
+    return palette, style, int(speed)
+
+
+def effect_key(palette, style, speed) -> str:
+    """Returns the content address of an effect"""
+    data = bytes([DIY_STYLES[style], speed]) + bytes(c for rgb in palette for c in rgb)
+    return hashlib.sha1(data).hexdigest()
+
+
+def encode(palette, style=DEFAULT_STYLE, speed=DEFAULT_SPEED, pm=None):
+    """Compile an effect without caching
+        :param palette: sequence of RGB tuples
+        :param style: one of DIY_STYLES
+        :param speed: 0-DIY_SPEED_MAX
+        :return list(GovPacket)
+    """
+    pm = pm if pm is not None else gov.H6127_PROTOCOL_MAP
+    palette, style, speed = validate(palette, style, speed)
+    stream = bytes([DIY_NAME, DIY_STYLES[style], DIY_MODE, speed, len(palette) * 3])
+    stream += bytes(c for rgb in palette for c in rgb)
+    chunks = [stream[i:i + DIY_CHUNK] for i in range(0, len(stream), DIY_CHUNK)]
+
+    def packet(*data):
+        # Short packets are zero padded, the checksum is applied by GovPacket
+        return gov.GovPacket.packed(pm, bytes(data).ljust(pm["packet_length"], b"\x00"))
+
+    packets = [packet(0xAA, 0x01), packet(DIY_INDICATOR, DIY_DATA, DIY_START, len(chunks))]
+    packets += [packet(DIY_INDICATOR, DIY_DATA, number, *chunk) for number, chunk in enumerate(chunks, 1)]
+    packets.append(packet(DIY_INDICATOR, DIY_DATA, DIY_END))
+    packets.append(packet(pm["indicator"], pm["commands"]["color"], DIY_RUN))
+    return packets
+
+
+def decode(stream: bytes):
+    """Decode the data stream of an uploaded effect
+        :param stream: concatenated data bytes of packets 1..n
+        :return (palette, style, speed) or None if the stream is malformed
+    """
+    styles = {code: name for name, code in DIY_STYLES.items()}
+    if len(stream) < 5 or stream[1] not in styles:
+        return None
+    count = stream[4]
+    colors = stream[5:5 + count]
+    if len(colors) != count or count % 3:
+        return None
+    palette = tuple(tuple(colors[i:i + 3]) for i in range(0, count, 3))
+    return palette, styles[stream[1]], stream[3]
+
+
+class DiyCache(object):
+    """Compiled effects by content address
+        cache = DiyCache()
+        packets = cache.get(palette, "fade", 50)
+
+    With a path every compiled effect is also written there as the raw
+    packet payloads, so later processes skip compiling.
+    """
+
+    def __init__(self, path=None, pm=None):
+        """Create a new cache
+            :param path: optional directory for the disk cache
+            :param pm: dict packet attributes, default H6127
+        """
+        self.path = path
+        self.pm = pm if pm is not None else gov.H6127_PROTOCOL_MAP
+        self.__effects = {}
+
+    def get(self, palette=DEFAULT_PALETTE, style=DEFAULT_STYLE, speed=DEFAULT_SPEED):
+        """Returns the packets for an effect, compiling it on first use
+            :return tuple(GovPacket)
+            :raises ValueError if any parameter is invalid
+        """
+        palette, style, speed = validate(palette, style, speed)
+        key = effect_key(palette, style, speed)
+        packets = self.__effects.get(key)
+        if packets is None:
+            packets = self.__load(key)
+            if packets is None:
+                packets = tuple(encode(palette, style, speed, self.pm))
+                self.__store(key, packets)
+            self.__effects[key] = packets
+        return packets
+
+    def __file(self, key):
+        return os.path.join(self.path, f"{key}.bin")
+
+    def __load(self, key):
+        """Read a compiled effect from disk, None if missing or damaged"""
+        if self.path is None:
+            return None
+        try:
+            with open(self.__file(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        size = self.pm["packet_length"]
+        if not data or len(data) % size:
+            return None
+        packets = tuple(gov.GovPacket.packed(self.pm, data[i:i + size]) for i in range(0, len(data), size))
+        if b"".join(p.get_payload() for p in packets) != data:
+            logger.warning(f"discarding damaged DIY cache entry {key}")
+            return None
+        return packets
+
+    def __store(self, key, packets):
+        """Write a compiled effect to disk if a path is set"""
+        if self.path is None:
+            return
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            tmp = f"{self.__file(key)}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(b"".join(p.get_payload() for p in packets))
+            os.replace(tmp, self.__file(key))
+        except OSError as ex:
+            logger.warning(f"failed to cache DIY effect {key}: {ex}")
+
+
+CACHE = DiyCache(GOVLE_DIY_CACHE_DIR)
@@ -2,10 +2,12 @@
 @file gov.py
 @brief Implements Govee BLE packet protocol
 """
-import datetime
+from functools import lru_cache, reduce
+from operator import xor
 
 GOVLE_SERVICE = "00010203-0405-0607-0809-0a0b0c0d1910"
 GOVLE_CHARACTERISTIC = "00010203-0405-0607-0809-0a0b0c0d2b11"
+GOVLE_NOTIFY_CHARACTERISTIC = "00010203-0405-0607-0809-0a0b0c0d2b10"
 
 H6127_PROTOCOL_MAP = {
     "packet_length": 0x14,
@@ -21,9 +23,18 @@ H6127_PROTOCOL_MAP = {
     "commands" : {"power": 0x01, "brightness": 0x04, "gradient": 0x14, "color": 0x05},
     "args": {
         "color": {"manual": 0x02, "segment": 0x0b}
-    }
+    },
+    # Status queries are answered by a notification starting with the
+    # query's first bytes, segment colors come in pages of four
+    "query" : {"indicator": 0xAA, "segments": 0xA5, "page_size": 4},
 }
 
+# Number of distinct color and segment packets kept by each Gov
+GOV_PACKET_CACHE_SIZE = 1024
+
+# Number of individually addressable segments on the strip
+SEGMENT_COUNT = 16
+
 def clamp(value, limits):
     """Clamps value to range [minimum, maximum]"""
     return min(limits["max"], max(limits["min"], value))
@@ -32,44 +43,92 @@ def bitmask_to_segment(u16):
     """Converts a 16-bit field into left and right sements for Govee LED strip"""
     return u16 & 0xFF, (u16 >> 8) & 0xFF
 
+def frame_masks(frame, previous=None):
+    """Groups the segments of a frame by color
+        :param frame: sequence of SEGMENT_COUNT RGB tuples
+        :param previous: optional frame already on the strip, segments that
+                         did not change are left out
+        :return list of (rgb, u16 mask) ordered by first segment
+    """
+    masks = {}
+    for i, rgb in enumerate(frame):
+        rgb = tuple(rgb)
+        if previous is not None and tuple(previous[i]) == rgb:
+            continue
+        masks[rgb] = masks.get(rgb, 0) | (1 << i)
+    return list(masks.items())
+
 class GovPacket(object):
-    """Govee packet builder"""
+    """Immutable Govee packet
+        The payload is stored as bytes with the XOR checksum applied once at
+        construction, so packets can be cached and shared between queues.
+    """
+    __slots__ = ("pm", "__payload", "__key", "__kind")
+
     def __init__(self, pm, data=None) -> None:
         """Create a new packet
             :param pm: dict packet attributes
             :param data: optional command data to insert
         """
-        # timestamp is required for message queue
-        self.timestamp = datetime.datetime.now()
-        self.pm = pm
-        self.__payload = [
-            self.pm["indicator"],
-            0x00, # Command
-            0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-            0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-            0x00, # XOR
-        ]
+        payload = bytearray(pm["packet_length"])
+        payload[0] = pm["indicator"]
         if data:
-            self.__payload[self.pm["arg_start"]:self.pm["arg_start"]+len(data)] = data
-        assert len(self.__payload) == self.pm["packet_length"], "Incorrect payload size"
-
-    def pack(self, full_packet):
-        """Manually specify a complete packet"""
-        self.__payload = full_packet
-        assert len(self.__payload) == self.pm["packet_length"], "Incorrect payload size"
-        return self
-
-    def get_payload(self) -> bytearray:
-        """Returns CRC'd payload as a bytearray"""
-        self.__crc()
-        return bytearray(self.__payload)
-
-    def __crc(self):
-        """Calculate and set XOR checksum byte"""
-        self.__payload[-1] = 0
-        for b in self.__payload[:-1]:
-            self.__payload[-1] ^= b
-        return self
+            payload[pm["arg_start"]:pm["arg_start"]+len(data)] = bytes(data)
+        self.__init(pm, payload)
+
+    @classmethod
+    def packed(cls, pm, full_packet):
+        """Create a packet from a manually specified complete payload
+            :param pm: dict packet attributes
+            :param full_packet: all packet bytes, the XOR byte is recomputed
+            :return GovPacket
+        """
+        packet = cls.__new__(cls)
+        packet.__init(pm, bytearray(full_packet))
+        return packet
+
+    def __init(self, pm, payload):
+        """Checksum payload and freeze the packet"""
+        assert len(payload) == pm["packet_length"], "Incorrect payload size"
+        payload[-1] = reduce(xor, payload[:-1], 0)
+        payload = bytes(payload)
+        object.__setattr__(self, "pm", pm)
+        object.__setattr__(self, "_GovPacket__payload", payload)
+        object.__setattr__(self, "_GovPacket__key", _coalesce_key(pm, payload))
+        object.__setattr__(self, "_GovPacket__kind", _kind(pm, payload))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GovPacket is immutable")
+
+    @property
+    def payload(self) -> bytes:
+        """Returns the checksummed payload"""
+        return self.__payload
+
+    def get_payload(self) -> bytes:
+        """Returns CRC'd payload as bytes"""
+        return self.__payload
+
+    @property
+    def coalesce_key(self):
+        """Returns a key naming the device state this packet overwrites
+            Packets with equal keys supersede each other so only the newest
+            one needs to reach the device. Packets that belong to ordered
+            sequences (keep-alive, DIY data) return None.
+            :return tuple or None
+        """
+        return self.__key
+
+    @property
+    def kind(self) -> str:
+        """Returns a short name for the packet type, used to label metrics"""
+        return self.__kind
+
+    def __eq__(self, other):
+        return isinstance(other, GovPacket) and self.__payload == other.__payload
+
+    def __hash__(self):
+        return hash(self.__payload)
 
     def __str__(self) -> str:
         return ",".join([f"{b:02X}" for b in self.__payload])
@@ -77,30 +136,122 @@ class GovPacket(object):
     def __repr__(self) -> str:
         return str(self)
 
-    def __lt__(self, other):
-        """Comparison function uses timestamp property"""
-        return self.timestamp < other.timestamp
 
-    def __gt__(self, other):
-        """Comparison function uses timestamp property"""
-        return self.timestamp > other.timestamp
+def decode(payload, pm=H6127_PROTOCOL_MAP):
+    """Decodes the device state a payload sets
+        :param payload: 20 packet bytes
+        :return tuple(kind, value) with kind as in GovPacket.kind and value
+                bool for power/gradient, int for brightness, RGB tuple for
+                color, (RGB tuple, u16 mask) for segment, None otherwise
+    """
+    kind = _kind(pm, payload)
+    if kind in ("power", "gradient"):
+        return kind, payload[2] == pm["constants"][True]
+    if kind == "brightness":
+        return kind, payload[2]
+    if kind == "color":
+        return kind, tuple(payload[3:6])
+    if kind == "segment":
+        return kind, (tuple(payload[3:6]), payload[6] | (payload[7] << 8))
+    return kind, None
+
+def decode_reply(payload, pm=H6127_PROTOCOL_MAP):
+    """Decodes the reply to a status query
+        :param payload: 20 notification bytes
+        :return tuple(kind, value) with value as in decode for power,
+                brightness and gradient, (first segment, list of RGB tuples)
+                for segments, None otherwise
+    """
+    query = pm["query"]
+    if len(payload) != pm["packet_length"] or payload[0] != query["indicator"] \
+            or reduce(xor, payload[:-1], 0) != payload[-1]:
+        return "other", None
+    if payload[1] == query["segments"]:
+        # Each segment is a brightness byte followed by its RGB triplet
+        first = (payload[2] - 1) * query["page_size"]
+        colors = [tuple(payload[4 + 4 * i:7 + 4 * i]) for i in range(query["page_size"])]
+        return "segments", (first, colors)
+    for name in ("power", "brightness", "gradient"):
+        if payload[1] == pm["commands"][name]:
+            return decode(bytes([pm["indicator"]]) + payload[1:], pm)
+    return "other", None
+
+def reply_prefix(query, pm=H6127_PROTOCOL_MAP) -> bytes:
+    """Returns the bytes the reply to a status query starts with"""
+    payload = query.get_payload()
+    return payload[:3] if payload[1] == pm["query"]["segments"] else payload[:2]
+
+def _kind(pm, payload):
+    """See GovPacket.kind"""
+    if payload[0] == 0xAA:
+        return "keep_alive"
+    if payload[0] == 0xA1:
+        return "diy"
+    if payload[0] != pm["indicator"]:
+        return "other"
+    for name, command in pm["commands"].items():
+        if payload[1] == command:
+            if name == "color":
+                for arg_name, arg in pm["args"]["color"].items():
+                    if payload[2] == arg:
+                        return "color" if arg_name == "manual" else arg_name
+                return "diy"
+            return name
+    return "other"
+
+def _coalesce_key(pm, payload):
+    """See GovPacket.coalesce_key"""
+    if payload[0] != pm["indicator"]:
+        return None
+    command = payload[1]
+    commands = pm["commands"]
+    if command in (commands["power"], commands["brightness"], commands["gradient"]):
+        return (command,)
+    if command == commands["color"]:
+        arg = payload[2]
+        if arg == pm["args"]["color"]["manual"]:
+            return (command, arg)
+        if arg == pm["args"]["color"]["segment"]:
+            # Segment mask (left, right) follows the RGB triplet
+            return (command, arg, payload[6], payload[7])
+    return None
 
 
 class Gov(object):
-    """Govee command builder"""
+    """Govee command builder
+        Fixed packets are built once per builder and served from tables,
+        color and segment packets come from bounded LRU caches.
+    """
 
     def __init__(self) -> None:
         super().__init__()
         self.pm = H6127_PROTOCOL_MAP
+        commands = self.pm["commands"]
+        constants = self.pm["constants"]
+        self.__power = {on: GovPacket(self.pm, [commands["power"], constants[on]]) for on in (True, False)}
+        self.__gradient = {on: GovPacket(self.pm, [commands["gradient"], constants[on]]) for on in (True, False)}
+        # Indexed by requested level 0-255, out of range levels share the
+        # packet of the level they clamp to
+        levels = [clamp(level, self.pm["limits"]["brightness"]) for level in range(0x100)]
+        packets = {level: GovPacket(self.pm, [commands["brightness"], level]) for level in set(levels)}
+        self.__brightness = tuple(packets[level] for level in levels)
+        self.__keep_alive = GovPacket.packed(self.pm, [0xAA, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+                                                       0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0xAB])
+        query = self.pm["query"]
+        blank = [0x00] * self.pm["packet_length"]
+        self.__queries = {name: GovPacket.packed(self.pm, [query["indicator"], commands[name]] + blank[2:])
+                          for name in ("power", "brightness", "gradient")}
+        self.__segment_queries = tuple(GovPacket.packed(self.pm, [query["indicator"], query["segments"], page + 1] + blank[3:])
+                                       for page in range(SEGMENT_COUNT // query["page_size"]))
+        self.__manual_color = lru_cache(maxsize=GOV_PACKET_CACHE_SIZE)(self.__build_manual_color)
+        self.__segment_color = lru_cache(maxsize=GOV_PACKET_CACHE_SIZE)(self.__build_segment_color)
 
     def set_power(self, on: bool):
         """Create a set power packet
             :param on: bool True for on
             :return GovPacket
         """
-        command = [self.pm["commands"]["power"], self.pm["constants"][on]]
-        packet = GovPacket(self.pm, command)
-        return packet
+        return self.__power[bool(on)]
 
     def set_brightness(self, level: int):
         """Create a set brightness packet
@@ -109,34 +260,21 @@ class Gov(object):
             :param level: 0 to 255
             :return GovPacket
         """
-        level = clamp(level, self.pm["limits"]["brightness"])
-        command = [self.pm["commands"]["brightness"], level]
-        packet = GovPacket(self.pm, command)
-        return packet
+        return self.__brightness[min(0xFF, max(0, int(level)))]
 
     def set_gradient(self, on: bool):
         """Create a set gradient enable state packet
             :param on: bool True for on
             :return GovPacket
         """
-        command = [self.pm["commands"]["gradient"], self.pm["constants"][on]]
-        packet = GovPacket(self.pm, command)
-        return packet
+        return self.__gradient[bool(on)]
 
     def set_manual_color(self, rgb: tuple):
         """Create a packet to set entire LED strip to one color
             :param rgb: tuple(int, int, int) color codes 0-255
             :return GovPacket
         """
-        red, green, blue = rgb
-        red = clamp(red, self.pm["limits"]["color"])
-        green = clamp(green, self.pm["limits"]["color"])
-        blue = clamp(blue, self.pm["limits"]["color"])
-        command = [self.pm["commands"]["color"], self.pm["args"]["color"]["manual"], red, green, blue,
-            # 0x00, 0xFF, 0xAE, 0x54 # TODO Warm/Cold seems to be required sometimes
-        ]
-        packet = GovPacket(self.pm, command)
-        return packet
+        return self.__manual_color(tuple(rgb))
 
     def set_segment_color(self, rgb: tuple, seg: tuple):
         """Create a packet to set segment of LED strip to one color
@@ -144,86 +282,79 @@ class Gov(object):
             :param seg: tuple(int, int) segment id for (left, right)
             :return GovPacket
         """
-        red, green, blue = rgb
-        left, right = seg
-        red = clamp(red, self.pm["limits"]["color"])
-        green = clamp(green, self.pm["limits"]["color"])
-        blue = clamp(blue, self.pm["limits"]["color"])
-        left = clamp(left, self.pm["limits"]["segment"])
-        right = clamp(right, self.pm["limits"]["segment"])
-        command = [self.pm["commands"]["color"], self.pm["args"]["color"]["segment"], red, green, blue,
-            left, right
-        ]
-        packet = GovPacket(self.pm, command)
-        return packet
+        return self.__segment_color(tuple(rgb), tuple(seg))
+
+    def encode_frame(self, frame, previous=None):
+        """Create the fewest segment packets that display frame
+            One packet is sent per distinct color, covering every segment
+            of that color. With previous, only changed segments are sent.
+            :param frame: sequence of SEGMENT_COUNT RGB tuples
+            :param previous: optional frame already on the strip
+            :return list(GovPacket)
+        """
+        assert len(frame) == SEGMENT_COUNT, f"frame must have {SEGMENT_COUNT} segments"
+        return [self.set_segment_color(rgb, bitmask_to_segment(mask))
+                for rgb, mask in frame_masks(frame, previous)]
 
     def keep_alive(self):
         """Create a keep alive packet
             :return GovPacket
         """
-        command = [0xAA, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-                   0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0xAB]
-        packet = GovPacket(self.pm)
-        packet.pack(command)
-        return packet
+        return self.__keep_alive
 
-    def make_diys(self):
-        """Builds a sample set of DIY packets
-            :return list(GovPacket)
+    def query_state(self, kind: str):
+        """Create a packet asking the device for one state
+            The power query is the keep-alive packet.
+            :param kind: power, brightness or gradient
+            :return GovPacket
         """
+        return self.__queries[kind]
 
-        def R(x):
-            return (x >> 16) & 0xFF
-        def G(x):
-            return (x >> 8) & 0xFF
-        def B(x):
-            return x & 0xFF
-
-        c1 = 0x440DFA
-        c2 = 0x0B13DE
-        c3 = 0x004BF5
-        c4 = 0x0DD1FA
-        c5 = c1
-        c6 = c2
-        c7 = c3
-        c8 = c4
-
-        return [
-            GovPacket(self.pm).pack([0xAA, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-             0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]), # Keep Alive
-            GovPacket(self.pm).pack([0xa1, 0x02,
-             0x00, # Packet number: always zero
-             0x02, # Total data packets
-             0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-             0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]), # Start Data
-
-            GovPacket(self.pm).pack([0xa1, 0x02,
-             0x01, # Packet number
-             0x03, # Name?
-             0x03, # Style: Fade, Jumping, Flicker, Marquee, Music
-             0x02, # Mode
-             0x64, # Speed: 0x00-0x64
-             0x18, # Padding
-             R(c1), G(c1), B(c1), # RGB
-             R(c2), G(c2), B(c2), # RGB
-             R(c3), G(c3), B(c3), # RGB
-             R(c4), G(c4),        # RG
-             0x00                 # XOR
-            ]), # Data
-            GovPacket(self.pm).pack([0xa1, 0x02,
-             0x02, # Packet number
-             B(c4), # B
-             R(c5), G(c5), B(c5), # RGB
-             R(c6), G(c6), B(c6), # RGB
-             R(c7), G(c7), B(c7), # RGB
-             R(c8), G(c8), B(c8), # RGB
-             0x00, 0x00, 0x00,    # Padding
-             0x00                 # XOR
-            ]), # Data
-
-            GovPacket(self.pm).pack([0xa1, 0x02, 0xff, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-             0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]), # End Data
-            GovPacket(self.pm).pack([0x33, 0x05, 0x0a, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-             0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]), # DIY Command
+    def query_segments(self, page: int):
+        """Create a packet asking the device for a page of segment colors
+            :param page: 0 for segments 0-3, 1 for 4-7 and so on
+            :return GovPacket
+        """
+        return self.__segment_queries[page]
+
+    def __build_manual_color(self, rgb):
+        """Uncached set_manual_color"""
+        red, green, blue = rgb
+        limits = self.pm["limits"]["color"]
+        red = clamp(int(red), limits)
+        green = clamp(int(green), limits)
+        blue = clamp(int(blue), limits)
+        command = [self.pm["commands"]["color"], self.pm["args"]["color"]["manual"], red, green, blue,
+            # 0x00, 0xFF, 0xAE, 0x54 # TODO Warm/Cold seems to be required sometimes
+        ]
+        return GovPacket(self.pm, command)
+
+    def __build_segment_color(self, rgb, seg):
+        """Uncached set_segment_color"""
+        red, green, blue = rgb
+        left, right = seg
+        limits = self.pm["limits"]["color"]
+        red = clamp(int(red), limits)
+        green = clamp(int(green), limits)
+        blue = clamp(int(blue), limits)
+        left = clamp(int(left), self.pm["limits"]["segment"])
+        right = clamp(int(right), self.pm["limits"]["segment"])
+        command = [self.pm["commands"]["color"], self.pm["args"]["color"]["segment"], red, green, blue,
+            left, right
         ]
+        return GovPacket(self.pm, command)
+
+    def make_diys(self, palette=None, style=None, speed=None):
+        """Builds the packets that upload and start a DIY effect
+            Compiled effects are shared through diy.CACHE.
+            :param palette: sequence of RGB tuples, default diy.DEFAULT_PALETTE
+            :param style: one of diy.DIY_STYLES, default marquee
+            :param speed: 0-100, default 100
+            :return tuple(GovPacket)
+        """
+        # diy builds on GovPacket, so it is imported on first use
+        from govle import diy
+        return diy.CACHE.get(palette if palette is not None else diy.DEFAULT_PALETTE,
+                             style if style is not None else diy.DEFAULT_STYLE,
+                             speed if speed is not None else diy.DEFAULT_SPEED)
 
@@ -1,10 +1,68 @@
 import asyncio
 
-from bleak import BleakScanner
-
-from govle import color, gov, le
+from govle import animation, color, discovery, diy, gov, le, scene, sched, shadow
 from govle.logging import logger
 
+BATCH_OPERATIONS = ("power", "brightness", "gradient", "color", "segment", "diy")
+
+
+def validate_batch(ops):
+    """Check every operation of a batch before anything is encoded
+        :param ops: list of {"op": name, "value": value} dicts, where value is
+                    a bool for power and gradient, 0-255 for brightness, an
+                    RGB triple for color, {"mask": int, "color": RGB} for
+                    segment and optional {"palette": [RGB, ...], "style":
+                    str, "speed": int} for diy
+        :return list of (name, value) tuples with normalised values
+        :raises ValueError naming the first invalid operation
+    """
+    steps = []
+    for index, op in enumerate(ops):
+        try:
+            name = op["op"]
+            value = op.get("value")
+            if name in ("power", "gradient"):
+                if not isinstance(value, bool):
+                    raise ValueError("value must be true or false")
+            elif name == "brightness":
+                value = _byte(value)
+            elif name == "color":
+                value = _rgb(value)
+            elif name == "segment":
+                mask = int(value["mask"])
+                if not 0 < mask <= 0xFFFF:
+                    raise ValueError("mask must select 1 to 16 segments")
+                value = (_rgb(value["color"]), mask)
+            elif name == "diy":
+                value = dict(value or {})
+                unknown = set(value) - {"palette", "style", "speed"}
+                if unknown:
+                    raise ValueError(f"unknown DIY parameters {', '.join(sorted(unknown))}")
+                palette, style, speed = diy.validate(value.get("palette", diy.DEFAULT_PALETTE),
+                                                     value.get("style", diy.DEFAULT_STYLE),
+                                                     value.get("speed", diy.DEFAULT_SPEED))
+                value = {"palette": palette, "style": style, "speed": speed}
+            else:
+                raise ValueError(f"unknown operation, expected one of {', '.join(BATCH_OPERATIONS)}")
+        except (KeyError, TypeError, ValueError) as ex:
+            raise ValueError(f"batch operation {index}: {ex}") from ex
+        steps.append((name, value))
+    return steps
+
+
+def _byte(value) -> int:
+    """Returns value as an int in 0-255"""
+    if isinstance(value, bool) or int(value) != value or not 0 <= value <= 255:
+        raise ValueError(f"{value!r} is not in range 0-255")
+    return int(value)
+
+
+def _rgb(value) -> tuple:
+    """Returns value as an RGB tuple of bytes"""
+    if len(value) != 3:
+        raise ValueError(f"{value!r} is not an RGB triple")
+    return tuple(_byte(c) for c in value)
+
 
 class Govle(object):
     """Creates a new Govee LE device
@@ -12,69 +70,278 @@ class Govle(object):
             gle.some_function()
     """
 
-    def __init__(self, address: str):
+    def __init__(self, address: str, limiter=None, transport_factory=None, window=None, state=None, shares=None):
+        """Create a new device
+            :param address: BLE address
+            :param limiter: optional transmit rate limiter, see govle.throttle
+            :param transport_factory: optional Transport factory, see govle.transport
+            :param window: optional throttle.AdaptiveWindow to pipeline writes
+            :param state: optional shadow.Shadow, e.g. from a ShadowStore
+            :param shares: optional dict of traffic class to packets per round,
+                           see sched.GOVLE_TRAFFIC_SHARES
+        """
         self.address = address
         self.gov = gov.Gov()
+        self.limiter = limiter
+        self.transport_factory = transport_factory
+        self.window = window
+        self.shares = shares
+        self.shadow = state if state is not None else shadow.Shadow(address)
+        self.le = None
+        # Segment colors last sent by set_color or show_frame, None if unknown
+        self.frame = None
 
     async def __aenter__(self):
-        self.le = le.Le(self.gov, gov.GOVLE_CHARACTERISTIC)
-        if not await self.le.connect(self.address):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        _ = (exc_type, exc_value, traceback)
+        await self.close()
+
+    async def open(self):
+        """Connect to the device and start the transmit workers"""
+        link = le.Le(self.gov, gov.GOVLE_CHARACTERISTIC, self.limiter, self.transport_factory, self.window,
+                     self.shadow, shares=self.shares)
+        if not await link.connect(self.address):
             raise le.LeGattException(f"Failed to connect to {self.address}")
+        self.le = link
         logger.debug(f"opened govle [{self.address}]")
         return self
 
-    async def __aexit__(self, exc_type, exc_value, traceback):
-        _ = (exc_type, exc_value, traceback)
+    async def close(self):
+        """Drain the transmit queue and disconnect"""
         await self.le.disconnet()
         logger.debug(f"closed govle [{self.address}]")
 
-    async def set_power(self, on: bool) -> None:
-        """Set power to on or off state"""
-        logger.debug(f"setting power: {on}")
+    @property
+    def is_connected(self):
+        """Returns true if the underlying link is up"""
+        return self.le is not None and self.le.is_connected
+
+    async def set_power(self, on: bool, wait=False):
+        """Set power to on or off state
+            :param wait: bool True to wait until the packet was transmitted
+            :return bool transmit success if wait is set, otherwise None
+        """
+        logger.debug("setting power: %s", on)
         packet = self.gov.set_power(on)
-        await self.le.write(packet)
+        return await self.le.write(packet, wait=wait)
 
-    async def set_brightness(self, level: int) -> None:
-        """Set brightness level. Level is in range 0-255."""
-        logger.debug(f"setting brightness: {level}")
+    async def set_brightness(self, level: int, wait=False):
+        """Set brightness level. Level is in range 0-255.
+            :param wait: bool True to wait until the packet was transmitted
+            :return bool transmit success if wait is set, otherwise None
+        """
+        logger.debug("setting brightness: %s", level)
         packet = self.gov.set_brightness(level)
-        await self.le.write(packet)
+        return await self.le.write(packet, wait=wait)
 
-    async def set_gradient(self, on: bool) -> None:
-        """Set gradient effect to on or off"""
-        logger.debug(f"setting gradient: {on}")
+    async def set_gradient(self, on: bool, wait=False):
+        """Set gradient effect to on or off
+            :param wait: bool True to wait until the packet was transmitted
+            :return bool transmit success if wait is set, otherwise None
+        """
+        logger.debug("setting gradient: %s", on)
         packet = self.gov.set_gradient(on)
-        await self.le.write(packet)
+        return await self.le.write(packet, wait=wait)
 
-    async def set_color(self, rgb) -> None:
-        """Set RGB color. Each color is in the range 0-255."""
-        logger.debug(f"setting color: {color.to_hex(rgb)}")
+    async def set_color(self, rgb, wait=False):
+        """Set RGB color. Each color is in the range 0-255.
+            :param wait: bool True to wait until the packet was transmitted
+            :return bool transmit success if wait is set, otherwise None
+        """
+        logger.debug("setting color: 0x%02X%02X%02X", *rgb)
         packet = self.gov.set_manual_color(rgb)
-        await self.le.write(packet)
+        self.frame = (tuple(rgb),) * gov.SEGMENT_COUNT
+        return await self.le.write(packet, wait=wait)
+
+    async def set_segment_color(self, rgb, mask: int, wait=False):
+        """Set the segments in a 16-bit mask to one RGB color
+            :param mask: bit n set selects segment n
+            :param wait: bool True to wait until the packet was transmitted
+            :return bool transmit success if wait is set, otherwise None
+        """
+        logger.debug("setting segments %04X: 0x%02X%02X%02X", mask, *rgb)
+        packet = self.gov.set_segment_color(rgb, gov.bitmask_to_segment(mask))
+        self.__paint(rgb, mask)
+        return await self.le.write(packet, wait=wait)
+
+    async def show_frame(self, frame, wait=False, deadline=None, written=False):
+        """Show one RGB color per segment, sending only what changed
+            Frames are animation traffic, interactive commands overtake them.
+            :param frame: sequence of 16 RGB tuples
+            :param wait: bool True to wait until all packets were transmitted
+            :param deadline: optional time.monotonic() after which unsent
+                             packets of this frame are dropped
+            :param written: bool True to stop waiting once pipelined packets
+                            were written, see Le.submit
+            :return bool transmit success if wait is set, otherwise None
+        """
+        frame = tuple(tuple(rgb) for rgb in frame)
+        packets = self.gov.encode_frame(frame, self.frame)
+        self.frame = frame
+        futures = self.le.submit(packets, sched.TRAFFIC_ANIMATION, deadline=deadline, written=written)
+        for future in futures:
+            future.add_done_callback(self.__check_frame)
+        if wait:
+            return all(await asyncio.gather(*futures))
+
+    def __check_frame(self, future):
+        """Forget the strip contents when a frame packet was not sent
+            The next frame is then sent in full instead of as a diff.
+        """
+        if not future.result():
+            self.frame = None
+
+    async def animate(self, frames, fps=None) -> animation.Animator:
+        """Play frames at a fixed rate, dropping frames the link cannot keep up with
+            :param frames: iterable of 16 RGB tuple frames
+            :param fps: frames per second, None to go as fast as the link
+            :return Animator with sent/dropped counts and achieved_fps
+        """
+        animator = animation.Animator(self, fps)
+        await animator.play(frames)
+        self.le.metrics.inc("frames_shown", amount=animator.sent)
+        self.le.metrics.inc("frames_dropped", amount=animator.dropped)
+        return animator
+
+    async def slide(self, background=color.WHITE, spot=color.GREEN, hold=0, forward=True) -> animation.Animator:
+        """Moves one segment around the complete LED strip
+            :param hold: seconds each step is shown, 0 for as fast as possible
+        """
+        await self.set_gradient(True)
+
+        def frames():
+            bits = range(gov.SEGMENT_COUNT) if forward else range(gov.SEGMENT_COUNT - 1, -1, -1)
+            for bit in bits:
+                frame = [background] * gov.SEGMENT_COUNT
+                frame[bit] = spot
+                yield frame
+
+        return await self.animate(frames(), 1 / hold if hold else None)
+
+    async def rainbow(self, seconds=10, fps=10, cycles=1.0) -> animation.Animator:
+        """Rotates a hue wheel along the strip
+            The whole timeline is computed up front with vcolor.
+            :param seconds: animation length
+            :param fps: frames per second
+            :param cycles: full hue rotations during the animation
+        """
+        # numpy is only loaded by the effects that use it
+        from govle import vcolor
 
-    async def slide(self, background=color.WHITE, spot=color.GREEN, hold=0, forward=True) -> None:
-        """Moves one segment around the complete LED strip"""
         await self.set_gradient(True)
+        timeline = vcolor.rainbow(max(1, int(seconds * fps)), cycles=cycles)
+        return await self.animate(vcolor.to_frames(timeline), fps)
+
+    async def diy(self, palette=None, style=None, speed=None, wait=False):
+        """Upload and start an on-device DIY effect
+            :param palette: sequence of RGB tuples, see diy.DEFAULT_PALETTE
+            :param style: fade, jumping, flicker, marquee or music
+            :param speed: 0-100
+            :param wait: bool True to wait until all packets were transmitted
+            :return bool transmit success if wait is set, otherwise None
+            :raises ValueError if the effect is invalid
+        """
+        packets = self.gov.make_diys(palette, style, speed)
+        self.frame = None
+        # Interactive like any other command so later commands are not
+        # overtaken by it, atomic so nothing splits the numbered upload
+        return await self.le.write_many(packets, sched.TRAFFIC_INTERACTIVE, coalesce=False, wait=wait, atomic=True)
+
+    async def batch(self, ops, wait=True):
+        """Send a sequence of operations as one burst
+            Every operation is validated before anything is queued, then all
+            packets are encoded and queued as one atomic unit, see
+            Le.submit: none is coalesced or dropped as redundant and nothing
+            else is sent between them, so the device sees exactly this
+            sequence.
+            :param ops: list of {"op": name, "value": value}, see validate_batch
+            :param wait: bool True to wait until every packet was transmitted
+            :return list of bool transmit success per operation if wait is set,
+                    otherwise None
+            :raises ValueError if any operation is invalid
+        """
+        steps = validate_batch(ops)
+        encoded = [self.__encode(name, value) for name, value in steps]
+        logger.debug(f"batch of {len(steps)} operations, {sum(len(p) for p in encoded)} packets")
+        # One class for the whole batch keeps power writes in sequence
+        futures = self.le.submit([p for packets in encoded for p in packets], sched.TRAFFIC_INTERACTIVE,
+                                 coalesce=False, atomic=True)
+        if not wait:
+            return None
+        results = await asyncio.gather(*futures)
+        per_op = []
+        start = 0
+        for packets in encoded:
+            per_op.append(all(results[start:start + len(packets)]))
+            start += len(packets)
+        return per_op
+
+    def __encode(self, name, value):
+        """Returns the packets for one validated batch operation"""
+        if name == "power":
+            return [self.gov.set_power(value)]
+        if name == "brightness":
+            return [self.gov.set_brightness(value)]
+        if name == "gradient":
+            return [self.gov.set_gradient(value)]
+        if name == "color":
+            self.frame = (value,) * gov.SEGMENT_COUNT
+            return [self.gov.set_manual_color(value)]
+        if name == "segment":
+            rgb, mask = value
+            self.__paint(rgb, mask)
+            return [self.gov.set_segment_color(rgb, gov.bitmask_to_segment(mask))]
+        self.frame = None
+        return list(self.gov.make_diys(**value))
+
+    def __paint(self, rgb, mask):
+        """Update the known frame after masked segments were set to rgb"""
+        if self.frame is not None:
+            self.frame = tuple(tuple(rgb) if mask & (1 << i) else c for i, c in enumerate(self.frame))
 
-        bits = range(16) if forward else range(15, -1, -1)
-        for bit in bits:
-            selected = 1 << bit
-            seg = gov.bitmask_to_segment(selected)
-            segment_packet = self.gov.set_segment_color(spot, seg)
-            await self.le.write(segment_packet)
+    def record(self, path: str) -> scene.SceneRecorder:
+        """Record every packet written from now on to a scene file
+            with gle.record("scene.govs"):
+                await gle.rainbow()
+            :return SceneRecorder, close it to stop recording
+        """
+        return scene.SceneRecorder(path).attach(self.le)
 
-            seg = gov.bitmask_to_segment(~selected)
-            background_packet = self.gov.set_segment_color(background, seg)
-            await self.le.write(background_packet)
+    async def replay(self, path: str, speed=1.0) -> int:
+        """Play a recorded scene file
+            :param speed: playback rate, 2.0 plays twice as fast
+            :return int number of packets queued
+            :raises scene.SceneError if path is not a scene file
+        """
+        with scene.ScenePlayer(path) as player:
+            # The scene leaves the strip in a state we did not encode
+            self.frame = None
+            return await player.play(self.le, speed)
 
-            await asyncio.sleep(hold)
+    async def music(self, path: str, fps=None, start=None) -> "music.MusicSync":
+        """Light the strip in time with a WAV file
+            Start the audio at the same moment, or pass the time it started.
+            :param path: WAV file
+            :param fps: frames per second, default music.GOVLE_MUSIC_FPS
+            :param start: optional time.monotonic() playback started at
+            :return MusicSync with sent/dropped counts
+            :raises ValueError if path can not be analysed
+        """
+        from govle import music
 
-    async def diy(self):
-        for packet in self.gov.make_diys():
-            await self.le.write(packet, le.GOVLE_PRIORITY_MAX)
+        sync = music.MusicSync(self, path, fps or music.GOVLE_MUSIC_FPS)
+        await sync.play(start)
+        self.le.metrics.inc("frames_shown", amount=sync.sent)
+        self.le.metrics.inc("frames_dropped", amount=sync.dropped)
+        return sync
 
     @staticmethod
-    async def discover():
-        """Discover and print all BLE devices in range"""
-        for device in await BleakScanner.discover():
-            print(device)
\ No newline at end of file
+    async def discover(timeout=discovery.GOVLE_SCAN_TIMEOUT, registry=None):
+        """Discover Govee strips in range
+            :param timeout: seconds to scan
+            :param registry: optional discovery.DeviceRegistry to update
+            :return list of discovery.DiscoveredDevice, strongest first
+        """
+        return await discovery.scan(registry, timeout)
\ No newline at end of file
@@ -0,0 +1,147 @@
+"""
+@file group.py
+@brief Drive several Govle devices as one
+"""
+import asyncio
+import time
+
+from govle import govle
+from govle.logging import logger
+
+GOVLE_GROUP_PARALLEL = 4 # maximum concurrent connection attempts
+
+
+class GroupResult(object):
+    """Outcome of one group command on one device"""
+    __slots__ = ("address", "success", "latency", "error")
+
+    def __init__(self, address, success, latency, error=None):
+        self.address = address
+        self.success = success
+        self.latency = latency
+        self.error = error
+
+    def to_dict(self) -> dict:
+        """Returns a JSON friendly summary"""
+        result = {"success": self.success, "latency": round(self.latency, 4)}
+        if self.error is not None:
+            result["error"] = str(self.error)
+        return result
+
+    def __repr__(self) -> str:
+        return f"GroupResult({self.address}, success={self.success}, latency={self.latency:.3f})"
+
+
+class GovleGroup(object):
+    """Controls several Govee LE devices together
+        async with GovleGroup(["<BLE::ADDRESS>", "<BLE::ADDRESS>"]) as group:
+            results = await group.set_power(True)
+
+    Commands fan out to every connected member at once and wait for each
+    device to transmit, so a group command takes about as long as the
+    slowest member.
+    """
+
+    def __init__(self, members, max_parallel=GOVLE_GROUP_PARALLEL, limiter_factory=None, transport_factory=None,
+                 window_factory=None):
+        """Create a new group
+            :param members: iterable of BLE addresses or Govle objects
+            :param max_parallel: maximum concurrent connection attempts
+            :param limiter_factory: optional callable returning a rate
+                                    limiter for each address member
+            :param transport_factory: optional Transport factory for address members
+            :param window_factory: optional callable returning a
+                                   throttle.AdaptiveWindow for each address member
+        """
+        self.members = []
+        for member in members:
+            if not isinstance(member, govle.Govle):
+                limiter = limiter_factory() if limiter_factory else None
+                window = window_factory() if window_factory else None
+                member = govle.Govle(member, limiter, transport_factory, window)
+            self.members.append(member)
+        self.max_parallel = max_parallel
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        _ = (exc_type, exc_value, traceback)
+        await self.close()
+
+    @property
+    def connected(self):
+        """Returns the members that have been opened"""
+        return [m for m in self.members if m.le is not None]
+
+    async def open(self) -> dict:
+        """Connect all members that are not open yet
+            :return dict of address to GroupResult
+        """
+        semaphore = asyncio.Semaphore(self.max_parallel)
+
+        async def connect(gle):
+            async with semaphore:
+                await gle.open()
+
+        pending = [m for m in self.members if m.le is None]
+        results = await self.__fan_out(pending, connect)
+        for result in results.values():
+            if not result.success:
+                logger.warning(f"group member [{result.address}] failed to connect: {result.error}")
+        return results
+
+    async def close(self) -> None:
+        """Disconnect all opened members"""
+        await self.__fan_out(self.connected, lambda gle: gle.close())
+
+    async def fan_out(self, action) -> dict:
+        """Run action(gle) on every connected member concurrently
+            :param action: async callable taking a Govle
+            :return dict of address to GroupResult
+        """
+        return await self.__fan_out(self.connected, action)
+
+    async def set_power(self, on: bool) -> dict:
+        """Set power on all members"""
+        return await self.fan_out(lambda gle: gle.set_power(on, wait=True))
+
+    async def set_brightness(self, level: int) -> dict:
+        """Set brightness on all members"""
+        return await self.fan_out(lambda gle: gle.set_brightness(level, wait=True))
+
+    async def set_gradient(self, on: bool) -> dict:
+        """Set gradient on all members"""
+        return await self.fan_out(lambda gle: gle.set_gradient(on, wait=True))
+
+    async def set_color(self, rgb) -> dict:
+        """Set color on all members"""
+        return await self.fan_out(lambda gle: gle.set_color(rgb, wait=True))
+
+    async def batch(self, ops) -> dict:
+        """Send the same batch to all members, see Govle.batch
+            :raises ValueError before anything is sent if ops are invalid
+        """
+        govle.validate_batch(ops)
+        return await self.fan_out(lambda gle: self.__batch_sent(gle, ops))
+
+    @staticmethod
+    async def __batch_sent(gle, ops):
+        """Returns true if every operation of the batch was sent"""
+        return all(await gle.batch(ops))
+
+    @staticmethod
+    async def __fan_out(members, action) -> dict:
+        """Run action on members concurrently and time each one"""
+
+        async def run(gle):
+            start = time.monotonic()
+            try:
+                success = await action(gle) is not False
+                return GroupResult(gle.address, success, time.monotonic() - start)
+            except Exception as ex:
+                return GroupResult(gle.address, False, time.monotonic() - start, ex)
+
+        results = await asyncio.gather(*[run(m) for m in members])
+        return {r.address: r for r in results}
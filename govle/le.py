@@ -1,86 +1,538 @@
 import asyncio
+import collections
+import random
 import time
 
-from bleak import BleakClient
-
-from govle.logging import logger
+from govle import gov, metrics, sched, throttle, transport
+from govle.logging import logger, trace
 
 GOVEE_KEEP_ALIVE = 2 # interval in seconds
-GOVLE_THROTTLE = 0 # mininum time between packets in seconds
+GOVLE_THROTTLE = 0 # mininum time between packets in seconds, 0 for no default limiter
+GOVLE_PIPELINE_LINGER = 0.05 # seconds an unconfirmed window waits for more writes before it is checked
+GOVLE_CHECK_FAILURES = 3 # state checks in a row without an answer before Le stops asking
+
+# Reconnect policy
+GOVLE_RECONNECT_ATTEMPTS = 5 # attempts before the device is considered unreachable
+GOVLE_RECONNECT_BACKOFF = 0.25 # seconds before the second attempt, doubles per attempt
+GOVLE_RECONNECT_BACKOFF_MAX = 8 # longest wait between attempts in seconds
+GOVLE_CIRCUIT_COOLDOWN = 30 # seconds writes fail fast once a device is unreachable
 
-# Message queue priorities
-GOVLE_PRIORITY_MAX = 0
-GOVLE_PRIORITY_MED = 10
-GOVLE_PRIORITY_MIN = 100
+# Link states
+LE_DISCONNECTED = "disconnected"
+LE_CONNECTING = "connecting"
+LE_CONNECTED = "connected"
+LE_UNREACHABLE = "unreachable"
 
 class LeNotConnectedException(Exception):
     """Attempted to read/write witout calling connect()"""
 
+class LeGattException(Exception):
+    """Device could not be reached over GATT"""
+
+class _Work(object):
+    """Transmit queue entry
+        Entries are queued by traffic class, see govle.sched. An entry whose
+        packet was replaced by a newer write of the same kind is marked
+        superseded and skipped by the transmit worker.
+    """
+    __slots__ = ("traffic", "packet", "key", "deadline", "unit_end", "written", "superseded", "future", "enqueued")
+
+    def __init__(self, traffic, packet, key=None, future=None, deadline=None, unit_end=None, written=False):
+        self.traffic = traffic
+        self.packet = packet
+        self.key = key
+        # Monotonic time after which sending is pointless, None for never
+        self.deadline = deadline
+        # None unless part of a unit, then True for its last entry
+        self.unit_end = unit_end
+        # Resolve once written, before a pipelined write is confirmed
+        self.written = written
+        self.superseded = False
+        # Resolves to True once the packet (or its replacement) was sent
+        self.future = future
+        self.enqueued = time.monotonic()
+
+    def resolve(self, success):
+        """Report the transmit result to anyone waiting on this entry"""
+        if self.future is not None and not self.future.done():
+            self.future.set_result(success)
+
+    def follow(self, other):
+        """Resolve this entry with the result of other, which replaced it"""
+        other.future.add_done_callback(lambda f: self.resolve(f.result()))
+
 class Le(object):
 
-    def __init__(self, packet_builder, write_characteristic):
+    def __init__(self, packet_builder, write_characteristic, limiter=None, transport_factory=None, window=None,
+                 shadow=None, keep_alive=None, shares=None):
+        """Create a new LE link
+            :param packet_builder: Gov used to build keep-alive packets
+            :param write_characteristic: GATT characteristic UUID to write
+            :param limiter: optional rate limiter, see govle.throttle
+            :param transport_factory: optional callable taking an address and
+                                      returning a Transport, default bleak
+            :param window: optional throttle.AdaptiveWindow to pipeline writes
+                           without response, None acknowledges every write
+            :param shadow: optional shadow.Shadow updated by successful writes
+                           and used to drop writes that change nothing
+            :param keep_alive: optional throttle.KeepAliveInterval, default
+                               starts at GOVEE_KEEP_ALIVE seconds
+            :param shares: optional dict of traffic class to packets per
+                           round, see sched.GOVLE_TRAFFIC_SHARES
+        """
         self.address = None
+        self.state = LE_DISCONNECTED
+        # Reconnect history, see reconnect_stats
+        self.reconnects = 0
+        self.failed_reconnects = 0
+        self.last_reconnect = None
+        self.reconnect_time = 0.0
         self.__client = None
+        self.__transport_factory = transport_factory or transport.BleakTransport
         self.__packet_builder = packet_builder
         self.__gatt_char = write_characteristic
+        if limiter is None:
+            if GOVLE_THROTTLE:
+                limiter = throttle.TokenBucket(1 / GOVLE_THROTTLE)
+            else:
+                limiter = throttle.NullLimiter()
+        self.limiter = limiter
+        self.window = window
+        self.shadow = shadow
+        # Optional scene.SceneRecorder receiving every queued packet
+        self.recorder = None
+        self.keep_alive = keep_alive or throttle.KeepAliveInterval(GOVEE_KEEP_ALIVE)
+        # Replaced with the device's metrics from the registry on connect
+        self.metrics = metrics.NULL_METRICS
 
-        # In order to guarantee our keep-alive packets arive on time, they
-        # are given max priority. All other messages will be processed in
-        # order in which they are received via their timestamp.
-        self.__work_q = asyncio.PriorityQueue()
-        self.__is_keep_alive_running = False
+        # Power and keep-alive packets go first, the other traffic classes
+        # share the link and are sent in order within their class. State
+        # writes that are still queued when a newer write of the same state
+        # arrives are dropped, as are packets that missed their deadline.
+        self.__work_q = sched.Scheduler(shares, self.__on_expired)
+        # Newest queued entry for each coalesce key, see GovPacket.coalesce_key
+        self.__pending = {}
+        # Queued or in-flight state writes per command byte
+        self.__unsettled = collections.Counter()
+        # Monotonic time the last packet went out, drives the keep-alive
+        self.__last_tx = time.monotonic()
+        self.__keep_alive_task = None
         self.__consumers = []
+        # Shared by everyone waiting for the link to come back
+        self.__reconnecting = None
+        # Monotonic time until which writes fail fast while unreachable
+        self.__circuit_until = 0.0
+        # State checks in a row the device did not answer
+        self.__check_failures = 0
+        self.__closing = asyncio.Event()
 
-    async def __transmit_worker(self):
-        """Waits for messages and transmits them to device"""
-        message_id = 0
+    async def __tx_with_retry(self, packet, retries=3):
+        """Simple retry loop returns success if tranmission succeeds"""
+        payload = packet.get_payload()
+        success, _ = await self.__retry(packet.kind, lambda: self.__client.write(self.__gatt_char, payload), retries)
+        return success
+
+    async def __query_with_retry(self, packet, retries=1):
+        """Send a status query, returns the reply or None if there was none"""
+        payload = packet.get_payload()
+        prefix = gov.reply_prefix(packet, packet.pm)
+        _, reply = await self.__retry("query", lambda: self.__client.query(self.__gatt_char, payload, prefix), retries)
+        return reply
+
+    async def __retry(self, kind, operation, retries):
+        """Run a link operation until it succeeds, reconnecting as required
+            :param kind: packet kind to label metrics with
+            :param operation: callable returning an awaitable for one attempt
+                              on the current client
+            :return tuple(bool success, result of the successful attempt)
+        """
+        retry = 0
+        while retry < retries:
+            if not self.is_connected and not await self.__reconnect():
+                # Unreachable, do not burn the remaining retries
+                break
+            try:
+                retry += 1
+                if retry > 1:
+                    self.metrics.inc("retries", kind)
+                start = time.monotonic()
+                result = await operation()
+                self.__last_tx = time.monotonic()
+                self.metrics.observe("write_latency", self.__last_tx - start, kind)
+                self.limiter.on_success()
+                return True, result
+            except Exception as ex:
+                logger.exception(ex)
+                await self.__on_write_error(kind)
+        return False, None
+
+    async def __on_write_error(self, kind):
+        """Back off after a failed write, the next write reconnects if the link dropped"""
+        self.metrics.inc("write_errors", kind)
+        self.limiter.on_error()
+        if self.window is not None:
+            self.window.on_error()
+        if not self.is_connected:
+            self.__on_link_down()
+
+    def __on_link_down(self):
+        """Record that a connected link dropped, once per drop
+            The idle time before the drop tells the keep-alive how long the
+            device tolerates silence.
+        """
+        if self.state != LE_CONNECTED:
+            return
+        self.state = LE_DISCONNECTED
+        self.keep_alive.on_disconnect(time.monotonic() - self.__last_tx)
+        self.metrics.set("keep_alive_interval", self.keep_alive.interval)
+
+    def __circuit_open(self) -> bool:
+        """Returns true while writes should fail without trying the device"""
+        return self.state == LE_UNREACHABLE and time.monotonic() < self.__circuit_until
 
-        async def tx_with_retry(packet, retries=3):
-            """Simple retry loop returns success if tranmission succeeds"""
-            retry = 0
-            success = False
-            payload = packet.get_payload()
-            while not success and retry < retries:
+    async def __open_link(self) -> bool:
+        """Create a transport and connect it"""
+        old = self.__client
+        if old is not None:
+            try:
+                await old.disconnect()
+            except Exception as ex:
+                logger.debug(f"[{self.address}] ignoring disconnect error: {ex}")
+        self.__client = self.__transport_factory(self.address)
+        await self.__client.connect()
+        if not self.__client.is_connected:
+            return False
+        self.state = LE_CONNECTED
+        self.__last_tx = time.monotonic()
+        if self.shadow is not None:
+            # The strip may have changed while we were away
+            self.shadow.invalidate()
+        return True
+
+    async def __reconnect(self) -> bool:
+        """Bring the link back, sharing one attempt between all callers
+            :return bool True if connected, False if the device is unreachable
+        """
+        # Usually the transport reports the drop before any write fails
+        self.__on_link_down()
+        if self.__circuit_open() or self.__closing.is_set():
+            return False
+        if self.__reconnecting is None:
+            self.__reconnecting = asyncio.ensure_future(self.__reconnect_with_backoff())
+        return await asyncio.shield(self.__reconnecting)
+
+    async def __reconnect_with_backoff(self) -> bool:
+        """Reconnect with exponential backoff and jitter, opening the circuit on failure
+            A device that was already unreachable gets a single attempt once
+            its cooldown expired, so a dead strip costs one connect attempt
+            per GOVLE_CIRCUIT_COOLDOWN.
+        """
+        attempts = 1 if self.state == LE_UNREACHABLE else GOVLE_RECONNECT_ATTEMPTS
+        self.state = LE_CONNECTING
+        start = time.monotonic()
+        try:
+            for attempt in range(attempts):
+                if attempt:
+                    delay = min(GOVLE_RECONNECT_BACKOFF_MAX, GOVLE_RECONNECT_BACKOFF * 2 ** (attempt - 1))
+                    try:
+                        # Sleep, unless disconnet() gives up on the link
+                        await asyncio.wait_for(self.__closing.wait(), delay * random.uniform(0.5, 1.5))
+                        break
+                    except asyncio.TimeoutError:
+                        pass
                 try:
-                    retry -= 1
-                    await self.__client.write_gatt_char(self.__gatt_char, payload)
-                    success = True
+                    if await self.__open_link():
+                        duration = time.monotonic() - start
+                        self.reconnects += 1
+                        self.last_reconnect = duration
+                        self.reconnect_time += duration
+                        self.metrics.inc("reconnects")
+                        self.metrics.observe("reconnect_duration", duration)
+                        self.metrics.set("circuit_open", 0)
+                        logger.info(f"[{self.address}] reconnected after {attempt + 1} attempts in {duration:.2f}s")
+                        return True
                 except Exception as ex:
-                    logger.exception(ex)
-                    if not self.is_connected:
-                        await self.connect(self.address)
-            return success
+                    logger.warning(f"[{self.address}] reconnect attempt {attempt + 1} failed: {ex}")
+                self.failed_reconnects += 1
+                self.metrics.inc("reconnect_failures")
+
+            self.state = LE_UNREACHABLE
+            self.__circuit_until = time.monotonic() + GOVLE_CIRCUIT_COOLDOWN
+            self.metrics.set("circuit_open", 1)
+            logger.warning(f"[{self.address}] unreachable, failing writes for {GOVLE_CIRCUIT_COOLDOWN}s")
+            return False
+        finally:
+            self.__reconnecting = None
+
+    def __on_expired(self, work):
+        """Fail an entry the scheduler dropped because its deadline passed"""
+        if work.superseded:
+            # Settled when it was replaced, resolves with its replacement
+            return
+        if work.key is not None and self.__pending.get(work.key) is work:
+            del self.__pending[work.key]
+        self.__settle(work)
+        work.resolve(False)
+        self.metrics.inc("expired", work.packet.kind)
+
+    def __complete(self, work, success, confirmed=True):
+        """Resolve a transmitted entry and record it
+            :param confirmed: bool False if the packet itself was not
+                              acknowledged, keeps it out of the shadow
+        """
+        self.__settle(work)
+        if success and confirmed and self.shadow is not None:
+            self.shadow.apply(work.packet)
+        work.resolve(success)
+        kind = work.packet.kind
+        if success:
+            self.metrics.inc("sent", kind)
+            self.metrics.observe("enqueue_to_ack", time.monotonic() - work.enqueued, kind)
+        else:
+            self.metrics.inc("failed", kind)
+
+    @staticmethod
+    def __pipelined(work) -> bool:
+        """Returns true if work may be written without response
+            Only state writes qualify, a lost one is found by checking the
+            state and repaired by writing it again. Power is always
+            acknowledged so no repair is ever sent after it, and ordered
+            sequences such as DIY uploads can not be repaired at all. Units
+            are acknowledged so a repair never lands in between their packets.
+        """
+        packet = work.packet
+        return work.unit_end is None and packet.coalesce_key is not None and packet.kind != "power"
+
+    async def __pipeline(self, work, unconfirmed):
+        """Write work without response, checking the window once it is full
+            :param work: entry to send, None to confirm what is in flight
+            :param unconfirmed: list of entries written but not yet confirmed
+        """
+        if work is None or not self.__pipelined(work):
+            # Everything in flight must be settled before this goes out
+            if unconfirmed:
+                await self.__confirm(unconfirmed)
+            if work is not None:
+                self.__complete(work, await self.__tx_with_retry(work.packet))
+            return
+
+        packet = work.packet
+        # Nothing follows and the sender waits for this write, close the window
+        last = self.__work_q.empty() and not work.written
+        if last and not unconfirmed:
+            # A lone write is cheapest acknowledged
+            self.__complete(work, await self.__tx_with_retry(packet))
+            return
+        unconfirmed.append(work)
+        try:
+            await self.__client.write(self.__gatt_char, packet.get_payload(), response=False)
+            self.__last_tx = time.monotonic()
+            self.limiter.on_success()
+            self.metrics.inc("pipelined", packet.kind)
+            if work.written:
+                work.resolve(True)
+        except Exception as ex:
+            logger.exception(ex)
+            await self.__on_write_error(packet.kind)
+            # The check reconnects and finds out what got through
+            await self.__confirm(unconfirmed)
+            return
+        if last or len(unconfirmed) >= self.window.size:
+            await self.__confirm(unconfirmed)
+
+    async def __confirm(self, unconfirmed):
+        """Settle entries written without response
+            Unacknowledged writes can be lost silently, so the device is asked
+            for every state the window set and only states that differ from
+            what the window left are written again, with response. Without an
+            answer every state is written again. The entries resolve True
+            once each state was found or repaired, and only then do those
+            states reach the shadow.
+            :param unconfirmed: entries written without response, in order
+        """
+        final = self.__final_states([w.packet for w in unconfirmed])
+        stale = await self.__check(final)
+        success = True
+        for packet in self.__repairs(stale):
+            if await self.__tx_with_retry(packet):
+                self.metrics.inc("repaired", packet.kind)
+                if self.shadow is not None:
+                    self.shadow.apply(packet)
+            else:
+                success = False
+        if self.shadow is not None:
+            for packet in self.__repairs({f: v for f, v in final.items() if f not in stale}):
+                self.shadow.apply(packet)
+        for w in unconfirmed:
+            self.__complete(w, success, confirmed=False)
+        unconfirmed.clear()
+        if stale:
+            # Writes got lost, send fewer before the next check
+            self.window.on_error()
+        else:
+            self.window.on_confirm()
+        self.metrics.set("window", self.window.size)
+
+    @staticmethod
+    def __final_states(packets):
+        """Returns the state packets leave on the strip
+            :param packets: state packets in the order they were written
+            :return dict of kind or segment index to (value, packet that set it)
+        """
+        final = {}
+        for packet in packets:
+            kind, value = gov.decode(packet.get_payload(), packet.pm)
+            if kind == "color":
+                value = (value, 0xFFFF)
+            if kind in ("color", "segment"):
+                rgb, mask = value
+                for i in range(gov.SEGMENT_COUNT):
+                    if mask & (1 << i):
+                        final[i] = (rgb, packet)
+            else:
+                final[kind] = (value, packet)
+        return final
+
+    async def __check(self, final):
+        """Ask the device for states, see __final_states
+            :return the part of final the device does not show, all of it
+                    if the device does not answer
+        """
+        if self.__check_failures >= GOVLE_CHECK_FAILURES:
+            # The device never answers, writing the states again is cheaper
+            return dict(final)
+        builder = self.__packet_builder
+        page_size = builder.pm["query"]["page_size"]
+        queries = [builder.query_state(f) for f in final if not isinstance(f, int)]
+        queries += [builder.query_segments(page) for page in sorted({f // page_size for f in final if isinstance(f, int)})]
+        stale = dict(final)
+        for query in queries:
+            reply = await self.__query_with_retry(query)
+            if reply is None:
+                self.__check_failures += 1
+                continue
+            self.__check_failures = 0
+            self.metrics.inc("state_checks")
+            kind, value = gov.decode_reply(reply, query.pm)
+            if kind == "segments":
+                first, colors = value
+                shown = dict(enumerate(colors, first))
+            else:
+                shown = {kind: value}
+            for field, value in shown.items():
+                if field in stale and stale[field][0] == value:
+                    del stale[field]
+        return stale
+
+    def __repairs(self, final):
+        """Returns packets that write states, see __final_states
+            Segments are regrouped by color, so the packets can go out in any
+            order.
+        """
+        repairs = []
+        masks = {}
+        sources = set()
+        for field, (value, packet) in final.items():
+            if isinstance(field, int):
+                masks[value] = masks.get(value, 0) | (1 << field)
+                sources.add(packet)
+            else:
+                repairs.append(packet)
+        if len(sources) == 1 and list(masks.values()) == [0xFFFF] and next(iter(sources)).kind == "color":
+            # The whole strip is still from one manual color, send it as it was
+            return repairs + list(sources)
+        return repairs + [self.__packet_builder.set_segment_color(rgb, gov.bitmask_to_segment(mask))
+                          for rgb, mask in masks.items()]
+
+    async def __transmit_worker(self):
+        """Waits for messages and transmits them to device"""
+        message_id = 0
+        unconfirmed = []
 
         while True:
             message_id += 1
 
+            # Throttle our transmission rate. The token is taken before the
+            # next packet is picked so coalescing can still replace it.
+            await self.limiter.acquire()
+
             # Wait for next message to send
-            work = await self.__work_q.get()
-
-            # Priority can be discarded, we just want the packet now
-            _, next_packet = work
-            if next_packet is not None:
-                logger.debug(f">>#{message_id:02d}|{next_packet}")
-                if await tx_with_retry(next_packet):
-                    logger.debug(f"message #{message_id} tx complete")
+            work = await self.__next_work(unconfirmed)
+            self.metrics.set("queue_depth", self.__work_q.qsize())
+            if work.key is not None and self.__pending.get(work.key) is work:
+                del self.__pending[work.key]
+
+            next_packet = work.packet
+            if next_packet is not None and self.__circuit_open():
+                self.metrics.inc("rejected", next_packet.kind)
+                self.__complete(work, False)
+            elif next_packet is not None:
+                traced = trace.sample()
+                if traced:
+                    trace.debug(">>#%02d|%s", message_id, next_packet)
+                if self.window is not None:
+                    await self.__pipeline(work, unconfirmed)
+                else:
+                    success = await self.__tx_with_retry(next_packet)
+                    self.__complete(work, success)
+                    if success and traced:
+                        trace.debug("message #%d tx complete", message_id)
             else:
                 logger.debug("tx worker received termination signal")
+                if unconfirmed:
+                    await self.__pipeline(None, unconfirmed)
                 self.__work_q.task_done()
                 break
 
             self.__work_q.task_done()
 
-            # Throttle our transmission rate
-            time.sleep(GOVLE_THROTTLE)
-
         logger.debug("tx worker thread stopped")
-        self.__is_keep_alive_running = False
+
+    async def __next_work(self, unconfirmed):
+        """Wait for the next entry to send, skipping superseded entries
+            A window still in flight is confirmed once nothing arrived for
+            GOVLE_PIPELINE_LINGER, so a paced sender such as the Animator
+            keeps it open between frames while nothing written waits long
+            for its confirmation.
+        """
+        while True:
+            work = await self.__work_q.get(GOVLE_PIPELINE_LINGER if unconfirmed else None)
+            if work is None:
+                await self.__pipeline(None, unconfirmed)
+            elif work.superseded:
+                # A newer write of the same state is further down the queue
+                # and will resolve this entry when it is sent
+                self.__work_q.task_done()
+            else:
+                return work
 
     async def __keep_alive(self):
-        """Put a keep-alive packet in the worker Q on the specified interval"""
-        if self.__is_keep_alive_running:
+        """Send a keep-alive whenever the link was idle for the keep-alive interval
+            Any other packet resets the idle time, so a busy link never
+            carries keep-alives.
+        """
+        while True:
+            if self.__circuit_open():
+                await asyncio.sleep(self.__circuit_until - time.monotonic())
+                continue
+            idle = time.monotonic() - self.__last_tx
+            if idle < self.keep_alive.interval:
+                await asyncio.sleep(self.keep_alive.interval - idle)
+                continue
+            if not self.__work_q.empty():
+                # Queued traffic will go out soon and keep the link alive
+                await asyncio.sleep(self.keep_alive.interval)
+                continue
             packet = self.__packet_builder.keep_alive()
-            await self.__work_q.put((GOVLE_PRIORITY_MAX+1, packet))
+            reconnects = self.reconnects
+            if await self.write(packet, sched.TRAFFIC_KEEP_ALIVE, wait=True):
+                self.metrics.inc("keep_alives")
+                if self.reconnects == reconnects:
+                    # Only a keep-alive that needed no reconnect kept the link up
+                    self.keep_alive.on_survived()
+                    self.metrics.set("keep_alive_interval", self.keep_alive.interval)
+            else:
+                await asyncio.sleep(self.keep_alive.interval)
 
     @property
     def is_connected(self):
@@ -89,26 +541,53 @@ class Le(object):
             return False
         return self.__client.is_connected
 
+    @property
+    def reconnect_stats(self) -> dict:
+        """Returns the link state and reconnect history"""
+        return {
+            "state": self.state,
+            "reconnects": self.reconnects,
+            "failed_reconnects": self.failed_reconnects,
+            "last_reconnect": self.last_reconnect,
+            "reconnect_time": self.reconnect_time,
+        }
+
+    @property
+    def pending(self):
+        """Returns the number of packets waiting in the transmit queue"""
+        return self.__work_q.qsize()
+
     async def connect(self, address: str) -> bool:
-        """Connect to the specified BLE address"""
+        """Connect to the specified BLE address and start the workers
+            Dropped links are reconnected by the transmit worker, connect
+            is only called once per Le.
+        """
         self.address = address
-        self.__client = BleakClient(address)
-        await self.__client.connect()
-        if self.is_connected:
-            self.__is_keep_alive_running = True
-            loop = asyncio.get_event_loop()
-            self.__consumers = [
-                loop.create_task(self.__keep_alive()),
-                loop.create_task(self.__transmit_worker())
-            ]
-
-        logger.debug(f"{address} connected: {self.is_connected}")
-        return self.__client.is_connected
+        self.metrics = metrics.REGISTRY.device(address)
+        self.state = LE_CONNECTING
+        if not await self.__open_link():
+            self.state = LE_DISCONNECTED
+            logger.debug(f"{address} connected: False")
+            return False
+
+        loop = asyncio.get_event_loop()
+        if not self.__consumers:
+            # Both run for the life of the Le, across reconnects
+            self.__keep_alive_task = loop.create_task(self.__keep_alive())
+            self.__consumers = [loop.create_task(self.__transmit_worker())]
+        logger.debug(f"{address} connected: True")
+        return True
 
     async def disconnet(self) -> None:
         """Disconnect from the current device"""
+        # Stop waiting for an unreachable device, queued writes fail fast
+        self.__closing.set()
+        if self.__keep_alive_task is not None:
+            self.__keep_alive_task.cancel()
+            self.__keep_alive_task = None
+
         # Stop the worker q
-        await self.__work_q.put((GOVLE_PRIORITY_MIN, None))
+        self.__work_q.put_final(_Work(None, None))
         logger.debug("joinging work queue")
         await self.__work_q.join()
         for c in self.__consumers:
@@ -118,8 +597,129 @@ class Le(object):
         if self.is_connected:
             await self.__client.disconnect()
             logger.debug("le worker queue/thread stopped")
-        logger.debug(f"le shutdown complete with {self.__work_q.qsize()} unprocessed packets")
+        self.state = LE_DISCONNECTED
+        unprocessed = self.__work_q.qsize()
+        self.metrics.set("unprocessed_at_disconnect", unprocessed)
+        logger.debug(f"le shutdown complete with {unprocessed} unprocessed packets")
+
+    async def write(self, message, traffic=None, coalesce=True, wait=False, deadline=None):
+        """Put message in the transmit q
+            :param message: GovPacket to send
+            :param traffic: sched traffic class, default from the packet kind
+            :param coalesce: bool True to let this packet replace a queued
+                             packet that sets the same state
+            :param wait: bool True to wait until the packet was transmitted
+            :param deadline: optional time.monotonic() after which the packet
+                             is dropped instead of sent
+            :return bool transmit success if wait is set, otherwise None
+        """
+        future = self.__enqueue(message, traffic, coalesce, deadline)
+        if wait:
+            return await future
+
+    async def write_many(self, messages, traffic=None, coalesce=True, wait=False, deadline=None, atomic=False,
+                         written=False):
+        """Put several messages in the transmit q in order
+            :param messages: iterable of GovPacket
+            :param wait: bool True to wait until every packet was transmitted
+            :param atomic: bool True to send the messages as a unit, see submit
+            :param written: bool True to stop waiting once written, see submit
+            :return bool True if all packets were sent if wait is set, otherwise None
+        """
+        futures = self.submit(messages, traffic, coalesce, deadline, atomic, written)
+        if wait:
+            return all(await asyncio.gather(*futures))
+
+    def submit(self, messages, traffic=None, coalesce=True, deadline=None, atomic=False, written=False):
+        """Queue messages as one contiguous burst
+            Nothing else can be queued in between. Given a traffic class
+            the burst is sent in order, but other classes, control traffic
+            first, may still be sent between its packets and a message the
+            shadow knows to change nothing is dropped. An atomic burst is
+            sent exactly as given: none is dropped as redundant, each is
+            acknowledged, and once the first went out nothing else is sent
+            until the last did.
+            :param messages: iterable of GovPacket
+            :param traffic: sched traffic class for all messages, default
+                            from each packet kind
+            :param deadline: optional time.monotonic() after which unsent
+                             messages are dropped
+            :param atomic: bool True to send the messages as one unit
+            :param written: bool True to resolve a message written without
+                            response as soon as it was written, instead of
+                            once the window was confirmed. Paced senders use
+                            it to keep the window open; a lost write is still
+                            repaired, but no longer reported.
+            :return list of futures resolving to each transmit result
+        """
+        if not atomic:
+            return [self.__enqueue(m, traffic, coalesce, deadline, written=written) for m in messages]
+        messages = list(messages)
+        return [self.__enqueue(m, traffic, coalesce, deadline, i == len(messages) - 1, written)
+                for i, m in enumerate(messages)]
+
+    def is_redundant(self, packet) -> bool:
+        """Returns true if packet would not change the device state
+            Only states confirmed by the shadow on this connection count, and
+            only while no other write of the same command is still queued or
+            in flight, since that could change the state again.
+        """
+        key = packet.coalesce_key
+        if key is None or self.shadow is None:
+            return False
+        unsettled = self.__unsettled[key[0]]
+        if unsettled == 0:
+            return self.shadow.is_redundant(packet)
+        queued = self.__pending.get(key)
+        # The same packet is already the last queued write of its command
+        return unsettled == 1 and queued is not None and queued.packet == packet
+
+    def __settle(self, work):
+        """Forget a state write that was sent, failed or superseded"""
+        key = work.packet.coalesce_key
+        if key is not None:
+            self.__unsettled[key[0]] -= 1
+
+    def __enqueue(self, message, traffic, coalesce, deadline, unit_end=None, written=False):
+        """Queue message, replacing any queued entry it supersedes
+            :param unit_end: None for a lone message, otherwise whether it
+                             ends an atomic unit
+            :param written: bool True to resolve once written, see submit
+            :return future resolving to the transmit result
+        """
+        loop = asyncio.get_running_loop()
+        if self.recorder is not None:
+            self.recorder.record(message)
+        if self.__circuit_open() or self.__closing.is_set():
+            self.metrics.inc("rejected", message.kind)
+            future = loop.create_future()
+            future.set_result(False)
+            return future
+        if unit_end is None and self.is_redundant(message):
+            self.metrics.inc("suppressed", message.kind)
+            future = loop.create_future()
+            future.set_result(True)
+            return future
+        if self.shadow is not None and message.kind == "diy":
+            self.shadow.invalidate_colors()
 
-    async def write(self, message, priority=GOVLE_PRIORITY_MED) -> None:
-        """Put message in the transmit q"""
-        await self.__work_q.put((priority, message))
\ No newline at end of file
+        # Members of a unit are never replaced, the unit is sent as given
+        key = message.coalesce_key if coalesce and unit_end is None else None
+        future = loop.create_future()
+        work = _Work(traffic or sched.classify(message), message, key, future, deadline, unit_end, written)
+        if key is not None:
+            previous = self.__pending.get(key)
+            if previous is not None:
+                previous.superseded = True
+                previous.follow(work)
+                self.__settle(previous)
+                self.metrics.inc("coalesced", message.kind)
+                if trace.sample():
+                    trace.debug("coalesced %s", previous.packet)
+            self.__pending[key] = work
+        if message.coalesce_key is not None:
+            self.__unsettled[message.coalesce_key[0]] += 1
+        self.__work_q.put_nowait(work)
+        self.metrics.inc("enqueued", message.kind)
+        self.metrics.set("queue_depth", self.__work_q.qsize())
+        return future
@@ -1,10 +1,32 @@
 """
 @file logging.py
+@brief Logging setup for govle
+
+Logging calls only put the record on a queue. A listener thread formats it
+and writes it to the log file and stdout, so a slow disk never stalls the
+event loop. Because formatting happens on that thread, log packets and other
+immutable values as %-style arguments instead of formatting them in the
+call; nothing is formatted at all when the level is disabled.
+
+Importing this module configures nothing, entry points call setup_logging
+to start writing. Without it warnings still reach stderr.
+
+Per packet lines go to the govle.trace logger through trace, which logs one
+packet in every trace.every, or none when every is 0. The GOVLE_TRACE
+environment variable sets the default.
 """
 
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
 import sys
 
+GOVLE_LOG_FILE = "govle.log"
+GOVLE_LOG_FORMAT = '[%(asctime)s] {%(filename)s:%(lineno)d} %(levelname)s - %(message)s'
+GOVLE_TRACE_EVERY = int(os.environ.get("GOVLE_TRACE", "1")) # trace one packet in this many, 0 for none
+
 # Silence logging
 logging.getLogger('asyncio').setLevel(logging.ERROR)
 logging.getLogger('bleak').setLevel(logging.ERROR)
@@ -16,7 +38,7 @@ class FancyLogFormatter(logging.Formatter):
     red = "\x1b[31m"
     underline_red = "\x1b[31;21m"
     reset = "\x1b[0m"
-    format = '[%(asctime)s] {%(filename)s:%(lineno)d} %(levelname)s - %(message)s'
+    format = GOVLE_LOG_FORMAT
 
     FORMATS = {
         logging.DEBUG: light_grey + format + reset,
@@ -26,21 +48,101 @@ class FancyLogFormatter(logging.Formatter):
         logging.CRITICAL: underline_red + format + reset
     }
 
+    def __init__(self):
+        super().__init__()
+        # One formatter per level, built once
+        self.__formatters = {level: logging.Formatter(fmt) for level, fmt in self.FORMATS.items()}
+        self.__default = logging.Formatter()
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
-        return formatter.format(record)
+        return self.__formatters.get(record.levelno, self.__default).format(record)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves all formatting to the listener thread
+        The stock handler merges the arguments into the message before
+        queueing, which is the work we want off the event loop.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class PacketTrace(object):
+    """Sampled per packet logging
+        if trace.sample():
+            trace.debug(">>%s", packet)
+    """
+
+    def __init__(self, every=GOVLE_TRACE_EVERY):
+        """Create a new trace
+            :param every: log one packet in this many, 0 to log none
+        """
+        self.every = every
+        self.logger = logging.getLogger('govle.trace')
+        self.__count = 0
+
+    def sample(self) -> bool:
+        """Returns True if the current packet should be logged"""
+        if self.every <= 0 or not self.logger.isEnabledFor(logging.DEBUG):
+            return False
+        self.__count += 1
+        return (self.__count - 1) % self.every == 0
+
+    def debug(self, msg, *args):
+        """Log a sampled packet line, attributed to the caller"""
+        self.logger.debug(msg, *args, stacklevel=2)
+
+
+trace = PacketTrace()
+listener = None
+
+
+def set_trace(every: int) -> None:
+    """Log one packet in every packets, 0 to turn packet tracing off"""
+    trace.every = every
+
+
+def setup_logging(level=logging.DEBUG, path=GOVLE_LOG_FILE, stream=sys.stdout) -> None:
+    """Route all logging through a queue to a log file and a stream
+        Calling it again replaces the previous setup.
+        :param level: root logger level
+        :param path: log file, None for no file
+        :param stream: stream for colored output, None for none
+    """
+    global listener
+    shutdown()
+    handlers = []
+    if path is not None:
+        file_handler = logging.FileHandler(filename=path)
+        file_handler.setFormatter(logging.Formatter(GOVLE_LOG_FORMAT))
+        handlers.append(file_handler)
+    if stream is not None:
+        stdout_handler = logging.StreamHandler(stream)
+        stdout_handler.setFormatter(FancyLogFormatter())
+        handlers.append(stdout_handler)
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in [h for h in root.handlers if isinstance(h, DeferredQueueHandler)]:
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(records))
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+
 
+def shutdown() -> None:
+    """Write out queued records and stop the listener thread"""
+    global listener
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        listener = None
 
-file_handler = logging.FileHandler(filename='govle.log')
-stdout_handler = logging.StreamHandler(sys.stdout)
-stdout_handler.setFormatter(FancyLogFormatter())
-handlers = [file_handler, stdout_handler]
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='[%(asctime)s] {%(filename)s:%(lineno)d} %(levelname)s - %(message)s',
-    handlers=handlers
-)
+# Runs before logging's own exit handler, so queued records are written
+atexit.register(shutdown)
 
-logger = logging.getLogger('govle')
\ No newline at end of file
+logger = logging.getLogger('govle')
@@ -0,0 +1,181 @@
+"""
+@file manager.py
+@brief Long-lived pool of connected Govle devices
+"""
+import asyncio
+import time
+
+from govle import discovery, group, govle
+from govle.logging import logger
+
+GOVLE_IDLE_TIMEOUT = 300 # seconds without use before a connection is closed
+GOVLE_REAP_INTERVAL = 10 # seconds between idle connection sweeps
+GOVLE_CLOSE_TIMEOUT = 10 # seconds to wait for a queue to drain on close
+
+
+class DeviceManager(object):
+    """Keeps one connected Govle per device address
+        manager = DeviceManager(config.devices)
+        await manager.start()
+        gle = await manager.get("office")
+        await gle.set_power(True)
+        await manager.stop()
+
+    Connections are opened on first use and closed again after idle_timeout
+    seconds without a request, so the next request reconnects lazily.
+    """
+
+    def __init__(self, devices: dict, idle_timeout=GOVLE_IDLE_TIMEOUT, limiter_factory=None, transport_factory=None,
+                 window_factory=None, store=None, registry=None):
+        """Create a new manager
+            :param devices: dict of friendly name to BLE address
+            :param idle_timeout: seconds before an unused connection is closed
+            :param limiter_factory: optional callable returning a rate limiter
+                                    for each new connection
+            :param transport_factory: optional Transport factory, see govle.transport
+            :param window_factory: optional callable returning a
+                                   throttle.AdaptiveWindow for each new connection
+            :param store: optional shadow.ShadowStore holding device state,
+                          saved whenever a connection closes
+            :param registry: optional discovery.DeviceRegistry used to resolve
+                             advertised names to addresses
+        """
+        self.devices = devices
+        self.idle_timeout = idle_timeout
+        self.limiter_factory = limiter_factory
+        self.transport_factory = transport_factory
+        self.window_factory = window_factory
+        self.store = store
+        self.registry = registry
+        self.__connections = {}
+        self.__last_used = {}
+        self.__locks = {}
+        self.__reaper = None
+
+    def resolve(self, name: str) -> str:
+        """Returns the address for a friendly name, or name if it is already an address
+            Names configured without an address, or mapped to an advertised
+            name such as ihoment_H6127_56DD, are looked up in the registry.
+        """
+        address = self.devices.get(name) or name
+        if self.registry is not None:
+            address = self.registry.address_for(address)
+        return address
+
+    def is_known(self, name: str) -> bool:
+        """Returns true if name is configured, discovered or an address"""
+        return name in self.devices or discovery.is_address(self.resolve(name))
+
+    @property
+    def connections(self):
+        """Returns a dict of address to open Govle"""
+        return dict(self.__connections)
+
+    async def start(self, preconnect=False) -> None:
+        """Start the idle reaper and optionally connect every known device
+            :param preconnect: bool True to connect all devices now
+        """
+        loop = asyncio.get_event_loop()
+        self.__reaper = loop.create_task(self.__reap())
+        if preconnect:
+            names = list(self.devices.keys())
+            results = await asyncio.gather(*[self.get(n) for n in names], return_exceptions=True)
+            for name, result in zip(names, results):
+                if isinstance(result, Exception):
+                    logger.warning(f"preconnect failed for {name}: {result}")
+
+    async def stop(self) -> None:
+        """Stop the reaper and close every open connection"""
+        if self.__reaper is not None:
+            self.__reaper.cancel()
+            self.__reaper = None
+        addresses = list(self.__connections.keys())
+        await asyncio.gather(*[self.__close(a) for a in addresses], return_exceptions=True)
+        self.__save()
+
+    def __save(self):
+        """Persist device state if a store is configured"""
+        if self.store is None:
+            return
+        try:
+            self.store.save()
+        except OSError as ex:
+            logger.warning(f"failed to save device state: {ex}")
+
+    async def get(self, name: str) -> govle.Govle:
+        """Returns a connected Govle for name, connecting if required
+            :param name: friendly name from devices or a BLE address
+            :return Govle
+        """
+        address = self.resolve(name)
+        self.__last_used[address] = time.monotonic()
+        gle = self.__connections.get(address)
+        if gle is not None:
+            return gle
+
+        # Only one coroutine may connect a given address at a time, everyone
+        # else waits here and then picks up the shared connection.
+        lock = self.__locks.setdefault(address, asyncio.Lock())
+        async with lock:
+            gle = self.__connections.get(address)
+            if gle is None:
+                limiter = self.limiter_factory() if self.limiter_factory else None
+                window = self.window_factory() if self.window_factory else None
+                state = self.store.get(address) if self.store else None
+                gle = govle.Govle(address, limiter, self.transport_factory, window, state)
+                await gle.open()
+                self.__connections[address] = gle
+                logger.debug(f"manager opened [{address}]")
+        return gle
+
+    async def get_group(self, names) -> group.GovleGroup:
+        """Returns a GovleGroup of pooled connections for names
+            Members that fail to connect are logged and left out.
+            :param names: iterable of friendly names or BLE addresses
+            :return GovleGroup
+        """
+        semaphore = asyncio.Semaphore(group.GOVLE_GROUP_PARALLEL)
+
+        async def get(name):
+            async with semaphore:
+                return await self.get(name)
+
+        names = list(names)
+        results = await asyncio.gather(*[get(n) for n in names], return_exceptions=True)
+        members = []
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logger.warning(f"group member {name} unavailable: {result}")
+            else:
+                members.append(result)
+        return group.GovleGroup(members)
+
+    async def __close(self, address: str, idle_since=None) -> None:
+        """Remove address from the pool and disconnect it
+            :param address: BLE address to close
+            :param idle_since: optional monotonic time, skip if used after it
+        """
+        lock = self.__locks.setdefault(address, asyncio.Lock())
+        async with lock:
+            if idle_since is not None and self.__last_used.get(address, 0) > idle_since:
+                return
+            gle = self.__connections.pop(address, None)
+            if gle is None:
+                return
+            try:
+                await asyncio.wait_for(gle.close(), GOVLE_CLOSE_TIMEOUT)
+            except Exception as ex:
+                logger.warning(f"error closing [{address}]: {ex}")
+            logger.debug(f"manager closed [{address}]")
+
+    async def __reap(self) -> None:
+        """Close connections that have not been used within idle_timeout"""
+        while True:
+            await asyncio.sleep(GOVLE_REAP_INTERVAL)
+            now = time.monotonic()
+            for address, gle in list(self.__connections.items()):
+                idle = now - self.__last_used.get(address, now)
+                if idle >= self.idle_timeout and gle.le.pending == 0:
+                    logger.debug(f"[{address}] idle for {idle:.0f}s")
+                    await self.__close(address, idle_since=now - self.idle_timeout)
+                    self.__save()
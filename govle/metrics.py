@@ -0,0 +1,174 @@
+"""
+@file metrics.py
+@brief In-process transmit metrics
+
+Each Le asks REGISTRY for the metrics of its device when it connects. While
+the registry is disabled it hands out NULL_METRICS, whose methods do nothing,
+so instrumentation costs one no-op call per event.
+
+    metrics.REGISTRY.enable()
+    ...
+    metrics.REGISTRY.snapshot()    # dict for JSON
+    metrics.REGISTRY.prometheus()  # Prometheus text exposition
+"""
+import bisect
+import collections
+
+# Upper bounds in seconds for latency histograms
+GOVLE_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    """Fixed bucket histogram"""
+    __slots__ = ("bounds", "counts", "count", "total")
+
+    def __init__(self, bounds=GOVLE_LATENCY_BUCKETS):
+        self.bounds = bounds
+        # One count per bound plus the +Inf bucket
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        """Record one sample"""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def cumulative(self):
+        """Returns (bound, samples <= bound) pairs ending with +Inf"""
+        running = 0
+        result = []
+        for bound, count in zip(list(self.bounds) + [float("inf")], self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "buckets": {("+Inf" if b == float("inf") else str(b)): c for b, c in self.cumulative()},
+        }
+
+
+class DeviceMetrics(object):
+    """Counters, gauges and histograms for one device
+        Counters and histograms are labelled with a packet kind, see
+        GovPacket.kind, or "" when the event is not about one packet.
+    """
+    enabled = True
+
+    def __init__(self, address: str):
+        self.address = address
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name: str, kind="", amount=1) -> None:
+        """Add amount to counter name"""
+        self.counters[(name, kind)] += amount
+
+    def set(self, name: str, value) -> None:
+        """Set gauge name"""
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float, kind="") -> None:
+        """Add a sample to histogram name"""
+        histogram = self.histograms.get((name, kind))
+        if histogram is None:
+            histogram = self.histograms[(name, kind)] = Histogram()
+        histogram.observe(value)
+
+    def snapshot(self) -> dict:
+        """Returns all metrics as nested dicts"""
+        counters = {}
+        for (name, kind), value in self.counters.items():
+            counters.setdefault(name, {})[kind or "all"] = value
+        histograms = {}
+        for (name, kind), histogram in self.histograms.items():
+            histograms.setdefault(name, {})[kind or "all"] = histogram.to_dict()
+        return {"counters": counters, "gauges": dict(self.gauges), "histograms": histograms}
+
+
+class NullMetrics(object):
+    """Metrics sink used while collection is disabled"""
+    enabled = False
+
+    def inc(self, name, kind="", amount=1) -> None:
+        pass
+
+    def set(self, name, value) -> None:
+        pass
+
+    def observe(self, name, value, kind="") -> None:
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+class Registry(object):
+    """Metrics for every device in this process"""
+
+    def __init__(self):
+        self.enabled = False
+        self.devices = {}
+
+    def enable(self, on=True) -> None:
+        """Turn collection on or off for devices that connect afterwards"""
+        self.enabled = on
+
+    def device(self, address: str):
+        """Returns the metrics for address, or NULL_METRICS when disabled"""
+        if not self.enabled:
+            return NULL_METRICS
+        metrics = self.devices.get(address)
+        if metrics is None:
+            metrics = self.devices[address] = DeviceMetrics(address)
+        return metrics
+
+    def snapshot(self) -> dict:
+        """Returns a JSON friendly dict of address to device metrics"""
+        return {address: m.snapshot() for address, m in self.devices.items()}
+
+    def prometheus(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format"""
+        counters = collections.defaultdict(list)
+        gauges = collections.defaultdict(list)
+        histograms = collections.defaultdict(list)
+        for address, m in self.devices.items():
+            for (name, kind), value in m.counters.items():
+                counters[name].append((_labels(address, kind), value))
+            for name, value in m.gauges.items():
+                gauges[name].append((_labels(address), value))
+            for (name, kind), histogram in m.histograms.items():
+                histograms[name].append((address, kind, histogram))
+
+        lines = []
+        for name, samples in sorted(counters.items()):
+            lines.append(f"# TYPE govle_{name}_total counter")
+            lines.extend(f"govle_{name}_total{{{labels}}} {value}" for labels, value in samples)
+        for name, samples in sorted(gauges.items()):
+            lines.append(f"# TYPE govle_{name} gauge")
+            lines.extend(f"govle_{name}{{{labels}}} {value}" for labels, value in samples)
+        for name, samples in sorted(histograms.items()):
+            lines.append(f"# TYPE govle_{name}_seconds histogram")
+            for address, kind, histogram in samples:
+                for bound, count in histogram.cumulative():
+                    le_label = "+Inf" if bound == float("inf") else bound
+                    lines.append(f"govle_{name}_seconds_bucket{{{_labels(address, kind)},le=\"{le_label}\"}} {count}")
+                lines.append(f"govle_{name}_seconds_sum{{{_labels(address, kind)}}} {histogram.total}")
+                lines.append(f"govle_{name}_seconds_count{{{_labels(address, kind)}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(address, kind=None):
+    """Format Prometheus labels"""
+    labels = f"device=\"{address}\""
+    if kind:
+        labels += f",kind=\"{kind}\""
+    return labels
+
+
+REGISTRY = Registry()
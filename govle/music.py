@@ -0,0 +1,209 @@
+"""
+@file music.py
+@brief Drive a strip from a WAV file in time with its playback
+
+    sync = MusicSync(gle, "song.wav", fps=20)
+    # start the audio player now
+    await sync.play()
+
+A worker process streams the file with the wave module and analyses it in
+hops of 1 / fps seconds: a Hann windowed FFT per hop is split into one
+log spaced band per segment. Band levels set segment value along a hue
+ramp from bass (red) to treble (blue) and the overall loudness sets the
+brightness. The worker hands over batches of finished frames through a
+bounded queue, so it runs at most GOVLE_MUSIC_RUN_AHEAD batches ahead of
+playback whatever the file length.
+"""
+import asyncio
+import multiprocessing
+import queue
+import time
+import wave
+
+import numpy as np
+
+from govle import gov, vcolor
+from govle.logging import logger
+
+GOVLE_MUSIC_FPS = 20
+GOVLE_MUSIC_BATCH = 32 # frames analysed per batch
+GOVLE_MUSIC_RUN_AHEAD = 4 # batches the worker may have waiting
+GOVLE_MUSIC_LOW = 40.0 # Hz, lower edge of the lowest band
+GOVLE_MUSIC_HIGH = 16000.0 # Hz, upper edge of the highest band
+GOVLE_MUSIC_RANGE = 40.0 # dB below the running peak that reads as silence
+GOVLE_MUSIC_DECAY = 0.995 # running peak decay per frame
+GOVLE_MUSIC_STEPS = 8 # value levels per segment, fewer levels need fewer packets
+
+
+def decode(raw: bytes, width: int, channels: int) -> np.ndarray:
+    """Convert PCM frames to mono float samples in [-1, 1]"""
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float64) - 128.0) / 128.0
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2") / 32768.0
+    elif width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        value = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        samples = np.where(value & 0x800000, value - 0x1000000, value) / 8388608.0
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4") / 2147483648.0
+    else:
+        raise ValueError(f"unsupported sample width {width}")
+    return samples.reshape(-1, channels).mean(axis=1)
+
+
+def band_edges(rate: int, size: int, bands=gov.SEGMENT_COUNT) -> np.ndarray:
+    """Returns the first FFT bin of each log spaced band and the end bin"""
+    high = min(GOVLE_MUSIC_HIGH, rate / 2)
+    hz = np.geomspace(GOVLE_MUSIC_LOW, high, bands + 1)
+    bins = np.rint(hz * size / rate).astype(np.int64)
+    # Every band needs at least one bin of its own
+    bins = np.maximum(bins, np.arange(bands + 1) + 1)
+    return np.minimum(bins, size // 2)
+
+
+class Analyzer(object):
+    """Turns hops of samples into frames and brightness levels"""
+
+    def __init__(self, rate: int, hop: int, bands=gov.SEGMENT_COUNT):
+        self.hop = hop
+        self.size = 1 << max(8, int(np.ceil(np.log2(2 * hop))))
+        self.window = np.hanning(self.size)
+        self.edges = band_edges(rate, self.size, bands)
+        self.hues = np.linspace(0.0, 0.7, bands)
+        self.__history = np.zeros(self.size - hop)
+        self.__peak = np.full(bands, -np.inf)
+        self.__loudest = -np.inf
+
+    def analyze(self, samples: np.ndarray):
+        """Analyse whole hops of samples
+            :param samples: mono floats, a multiple of hop long
+            :return (frames uint8 (n, bands, 3), brightness uint8 (n,))
+        """
+        data = np.concatenate([self.__history, samples])
+        self.__history = data[len(data) - (self.size - self.hop):]
+        windows = np.lib.stride_tricks.sliding_window_view(data, self.size)[::self.hop]
+        power = np.abs(np.fft.rfft(windows * self.window, axis=1)) ** 2
+        energy = np.add.reduceat(power, self.edges[:-1], axis=1)
+        db = 10 * np.log10(energy + 1e-12)
+        loud = 10 * np.log10(np.mean(windows[:, -self.hop:] ** 2, axis=1) + 1e-12)
+
+        levels = np.empty_like(db)
+        brightness = np.empty(len(db))
+        for i in range(len(db)):
+            # Running peaks adapt to the recording level
+            self.__peak = np.maximum(self.__peak + 10 * np.log10(GOVLE_MUSIC_DECAY), db[i])
+            self.__loudest = max(self.__loudest + 10 * np.log10(GOVLE_MUSIC_DECAY), loud[i])
+            levels[i] = (db[i] - self.__peak) / GOVLE_MUSIC_RANGE + 1.0
+            brightness[i] = (loud[i] - self.__loudest) / GOVLE_MUSIC_RANGE + 1.0
+
+        levels = np.floor(np.clip(levels, 0.0, 1.0) * GOVLE_MUSIC_STEPS) / GOVLE_MUSIC_STEPS
+        hsv = np.stack([np.broadcast_to(self.hues, levels.shape), np.ones_like(levels), levels], axis=-1)
+        limits = gov.H6127_PROTOCOL_MAP["limits"]["brightness"]
+        brightness = limits["min"] + np.floor(np.clip(brightness, 0.0, 1.0) * 16) / 16 * (limits["max"] - limits["min"])
+        return vcolor.hsv_to_rgb(hsv), brightness.astype(np.uint8)
+
+
+def _analyze(path, fps, out):
+    """Worker process body
+        Puts ("format", rate, hop), then ("frames", frames, brightness) per
+        batch or ("error", message), then None.
+    """
+    try:
+        with wave.open(path, "rb") as w:
+            rate = w.getframerate()
+            hop = max(1, round(rate / fps))
+            out.put(("format", rate, hop))
+            analyzer = Analyzer(rate, hop)
+            while True:
+                raw = w.readframes(hop * GOVLE_MUSIC_BATCH)
+                samples = decode(raw, w.getsampwidth(), w.getnchannels())
+                usable = len(samples) - len(samples) % hop
+                if usable:
+                    out.put(("frames",) + analyzer.analyze(samples[:usable]))
+                if usable < hop * GOVLE_MUSIC_BATCH:
+                    break
+    except Exception as ex:
+        out.put(("error", f"{type(ex).__name__}: {ex}"))
+    out.put(None)
+
+
+def _receive(out, worker):
+    """Blocking read of the next worker message, an error if the worker died"""
+    while True:
+        try:
+            return out.get(timeout=0.5)
+        except queue.Empty:
+            if not worker.is_alive():
+                return ("error", f"analysis worker exited with code {worker.exitcode}")
+
+
+class MusicSync(object):
+    """Plays the analysis of a WAV file on a Govle against a monotonic clock"""
+
+    def __init__(self, gle, path: str, fps=GOVLE_MUSIC_FPS):
+        """Create a new sync
+            :param gle: open Govle to draw on
+            :param path: WAV file
+            :param fps: analysis frames per second
+        """
+        self.gle = gle
+        self.path = path
+        self.fps = fps
+        self.period = 1 / fps
+        self.sent = 0
+        self.dropped = 0
+
+    async def play(self, start=None) -> None:
+        """Show every frame at its time in the file
+            Frames the link can not keep up with are dropped.
+            :param start: optional time.monotonic() playback started at,
+                          default now
+            :raises ValueError if the worker could not read the file
+        """
+        context = multiprocessing.get_context("spawn")
+        out = context.Queue(GOVLE_MUSIC_RUN_AHEAD)
+        worker = context.Process(target=_analyze, args=(self.path, self.fps, out), daemon=True)
+        worker.start()
+        loop = asyncio.get_running_loop()
+        try:
+            header = await loop.run_in_executor(None, _receive, out, worker)
+            if header[0] == "error":
+                raise ValueError(f"can not analyse {self.path}: {header[1]}")
+            _, rate, hop = header
+            # Hops are whole samples, keep the clock on the file's timeline
+            self.period = hop / rate
+            if start is None:
+                start = time.monotonic()
+            await self.gle.set_gradient(True)
+            index = 0
+            while True:
+                batch = await loop.run_in_executor(None, _receive, out, worker)
+                if batch is None:
+                    break
+                if batch[0] == "error":
+                    raise ValueError(f"can not analyse {self.path}: {batch[1]}")
+                for frame, level in zip(*batch[1:]):
+                    due = start + index * self.period
+                    index += 1
+                    now = time.monotonic()
+                    if now >= due + self.period:
+                        self.dropped += 1
+                        continue
+                    if now < due:
+                        await asyncio.sleep(due - now)
+                    await self.gle.set_brightness(int(level))
+                    await self.gle.show_frame(frame.tolist(), deadline=due + self.period)
+                    self.sent += 1
+        finally:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+            # Drop anything the worker left so the queue's feeder thread exits
+            try:
+                while True:
+                    out.get_nowait()
+            except (queue.Empty, OSError, ValueError):
+                pass
+            out.close()
+        logger.debug(f"music sent {self.sent} frames, dropped {self.dropped}")
@@ -0,0 +1,218 @@
+"""
+@file scene.py
+@brief Binary scene recording and timed replay
+
+A scene file is a small header followed by fixed size records, one per
+packet written to Le:
+
+    header  "GOVS", version u8, payload length u8, 2 bytes padding
+    record  delay since the previous record in microseconds u32 LE,
+            20 byte packet payload
+
+    with gle.record("sunrise.govs"):
+        await gle.slide(...)
+    await gle.replay("sunrise.govs")
+
+Replay memory-maps the file and queues the stored payloads as they are, so
+a scene costs no encoding however long it is. A recorded DIY upload is
+queued as one atomic unit, as Govle.diy sends it, so no other packet can
+land between its numbered data packets.
+"""
+import asyncio
+import mmap
+import struct
+import time
+
+from govle import diy, gov, sched
+from govle.logging import logger
+
+SCENE_MAGIC = b"GOVS"
+SCENE_VERSION = 1
+SCENE_HEADER = struct.Struct("<4sBB2x")
+SCENE_RECORD = struct.Struct(f"<I{gov.H6127_PROTOCOL_MAP['packet_length']}s")
+# Longest delay one record can hold
+SCENE_MAX_DELAY = 0xFFFFFFFF / 1e6
+# Records due within this many seconds of each other are queued together
+SCENE_SLACK = 0.002
+
+
+class SceneError(Exception):
+    """Scene file is missing, damaged or of an unknown version"""
+
+
+class SceneRecorder(object):
+    """Writes every packet queued on an Le to a scene file
+        recorder = SceneRecorder("scene.govs").attach(gle.le)
+        ...
+        recorder.close()
+
+    Keep-alives are not recorded, the player's link sends its own.
+    """
+
+    def __init__(self, path: str, pm=gov.H6127_PROTOCOL_MAP):
+        self.path = path
+        self.count = 0
+        self.__le = None
+        self.__last = None
+        self.__file = open(path, "wb")
+        self.__file.write(SCENE_HEADER.pack(SCENE_MAGIC, SCENE_VERSION, pm["packet_length"]))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _ = (exc_type, exc_value, traceback)
+        self.close()
+
+    def attach(self, link):
+        """Start recording writes to link
+            :param link: Le to record
+            :return self
+        """
+        self.__le = link
+        link.recorder = self
+        return self
+
+    def record(self, packet) -> None:
+        """Append one packet, timed relative to the previous one"""
+        if packet.kind == "keep_alive":
+            return
+        now = time.monotonic()
+        delay = 0.0 if self.__last is None else min(now - self.__last, SCENE_MAX_DELAY)
+        self.__last = now
+        self.__file.write(SCENE_RECORD.pack(int(delay * 1e6), packet.get_payload()))
+        self.count += 1
+
+    def close(self) -> None:
+        """Stop recording and close the file"""
+        if self.__le is not None and self.__le.recorder is self:
+            self.__le.recorder = None
+        self.__le = None
+        if not self.__file.closed:
+            self.__file.close()
+            logger.debug(f"recorded {self.count} packets to {self.path}")
+
+
+class ScenePlayer(object):
+    """Streams a recorded scene to an Le
+        with ScenePlayer("scene.govs") as player:
+            await player.play(gle.le)
+    """
+
+    def __init__(self, path: str, pm=gov.H6127_PROTOCOL_MAP):
+        """Open and check a scene file
+            :raises SceneError if the file is not a scene
+        """
+        self.path = path
+        self.pm = pm
+        try:
+            with open(path, "rb") as f:
+                self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as ex:
+            raise SceneError(f"can not open scene {path}: {ex}") from ex
+        if len(self.__map) < SCENE_HEADER.size:
+            self.close()
+            raise SceneError(f"{path} is not a scene file")
+        magic, version, length = SCENE_HEADER.unpack_from(self.__map)
+        if magic != SCENE_MAGIC or version != SCENE_VERSION or length != pm["packet_length"]:
+            self.close()
+            raise SceneError(f"{path} is not a version {SCENE_VERSION} scene file")
+        # A partly written last record is ignored
+        self.count = (len(self.__map) - SCENE_HEADER.size) // SCENE_RECORD.size
+        # Scenes repeat the same few packets, build each one once
+        self.__packets = {}
+        # The recorder leaves out keep-alives, including the one that
+        # opens a DIY upload, so replayed uploads get it back
+        self.__diy_preamble = self.__packet(bytes([0xAA, 0x01]).ljust(pm["packet_length"], b"\x00"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _ = (exc_type, exc_value, traceback)
+        self.close()
+
+    @property
+    def duration(self) -> float:
+        """Returns the scene length in seconds"""
+        return sum(delay for delay, _ in self.records()) / 1e6
+
+    def records(self):
+        """Yields (delay in microseconds, payload bytes) for every record"""
+        for offset in range(SCENE_HEADER.size, SCENE_HEADER.size + self.count * SCENE_RECORD.size,
+                            SCENE_RECORD.size):
+            yield SCENE_RECORD.unpack_from(self.__map, offset)
+
+    def __packet(self, payload):
+        packet = self.__packets.get(payload)
+        if packet is None:
+            packet = self.__packets[payload] = gov.GovPacket.packed(self.pm, payload)
+        return packet
+
+    def __diy_data(self, payload) -> bool:
+        """Returns true if payload is one of the 0xA1 0x02 packets of a DIY upload"""
+        return payload[0] == diy.DIY_INDICATOR and payload[1] == diy.DIY_DATA
+
+    def __diy_run(self, payload) -> bool:
+        """Returns true if payload starts an uploaded DIY effect"""
+        return payload[0] == self.pm["indicator"] and payload[1] == self.pm["commands"]["color"] \
+            and payload[2] == diy.DIY_RUN
+
+    async def play(self, link, speed=1.0) -> int:
+        """Queue every record on link at its recorded time
+            Record times are measured from the start of playback rather than
+            from the previous record, so sleep overshoot never accumulates.
+            Records due together are queued as one burst. State writes the
+            link can not keep up with coalesce in its queue. A DIY upload,
+            from its start packet up to the command that runs it, is queued
+            as one atomic interactive unit once its start is due.
+            :param link: connected Le
+            :param speed: playback rate, 2.0 plays twice as fast
+            :return int number of packets queued
+        """
+        start = time.monotonic()
+        due = 0.0
+        burst = []
+        # DIY upload being collected, None outside of one
+        unit = None
+        queued = 0
+        for delay, payload in self.records():
+            due += delay / 1e6 / speed
+            if unit is not None:
+                if self.__diy_data(payload) and payload[2] != diy.DIY_START:
+                    unit.append(self.__packet(payload))
+                    continue
+                if self.__diy_run(payload):
+                    unit.append(self.__packet(payload))
+                link.submit(unit, sched.TRAFFIC_INTERACTIVE, coalesce=False, atomic=True)
+                queued += len(unit) - 1
+                unit = None
+                if self.__diy_run(payload):
+                    continue
+            wait = start + due - time.monotonic()
+            if wait > SCENE_SLACK:
+                if burst:
+                    link.submit(burst, sched.TRAFFIC_ANIMATION)
+                    queued += len(burst)
+                    burst = []
+                await asyncio.sleep(wait)
+            if self.__diy_data(payload) and payload[2] == diy.DIY_START:
+                # Everything before the upload goes first
+                if burst:
+                    link.submit(burst, sched.TRAFFIC_ANIMATION)
+                    queued += len(burst)
+                    burst = []
+                unit = [self.__diy_preamble, self.__packet(payload)]
+                continue
+            burst.append(self.__packet(payload))
+        if unit is not None:
+            link.submit(unit, sched.TRAFFIC_INTERACTIVE, coalesce=False, atomic=True)
+            queued += len(unit) - 1
+        if burst:
+            link.submit(burst, sched.TRAFFIC_ANIMATION)
+            queued += len(burst)
+        logger.debug(f"replayed {queued} packets from {self.path}, drift {time.monotonic() - start - due:+.4f}s")
+        return queued
+
+    def close(self) -> None:
+        self.__map.close()
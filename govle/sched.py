@@ -0,0 +1,190 @@
+"""
+@file sched.py
+@brief Traffic class transmit scheduler
+
+Every queued packet belongs to a traffic class:
+
+    control      power, always sent first
+    keep_alive   link keep-alives, sent before any other traffic
+    interactive  user commands such as color or brightness
+    animation    frames from show_frame and Animator, usually with deadlines
+    bulk         background transfers, DIY data not sent as a unit
+
+Control and keep-alive traffic is strictly first. The remaining classes
+share the link by weighted round robin, interactive first, so a click is
+never queued behind hundreds of frames while long animations and uploads
+still make progress. Within a class packets stay in FIFO order. A packet
+whose deadline passed before it reached the head of the link is dropped.
+
+Entries queued as a unit, such as a DIY upload, go out back to back: once
+the first one is sent the class is pinned until the last one is, so not
+even control traffic lands in between.
+"""
+import asyncio
+import collections
+import time
+
+TRAFFIC_CONTROL = "control"
+TRAFFIC_KEEP_ALIVE = "keep_alive"
+TRAFFIC_INTERACTIVE = "interactive"
+TRAFFIC_ANIMATION = "animation"
+TRAFFIC_BULK = "bulk"
+
+# Classes served strictly in this order before any weighted class
+TRAFFIC_STRICT = (TRAFFIC_CONTROL, TRAFFIC_KEEP_ALIVE)
+# Packets per round each weighted class may send while others wait
+GOVLE_TRAFFIC_SHARES = {TRAFFIC_INTERACTIVE: 8, TRAFFIC_ANIMATION: 4, TRAFFIC_BULK: 1}
+TRAFFIC_CLASSES = TRAFFIC_STRICT + tuple(GOVLE_TRAFFIC_SHARES)
+
+
+def classify(packet) -> str:
+    """Returns the default traffic class for a packet"""
+    kind = packet.kind
+    if kind == "power":
+        return TRAFFIC_CONTROL
+    if kind == "keep_alive":
+        return TRAFFIC_KEEP_ALIVE
+    if kind == "diy":
+        return TRAFFIC_BULK
+    return TRAFFIC_INTERACTIVE
+
+
+class Scheduler(object):
+    """Queue of transmit work with the asyncio.Queue interface Le uses
+        Entries need traffic, deadline and unit_end attributes, deadline
+        being a time.monotonic() value or None and unit_end None for a lone
+        entry, False for members of a unit but its last, True for the last.
+    """
+
+    def __init__(self, shares=None, on_expired=None):
+        """Create a new scheduler
+            :param shares: optional dict of weighted class to packets per
+                           round, merged over GOVLE_TRAFFIC_SHARES
+            :param on_expired: optional callable taking each entry dropped
+                               because its deadline passed
+        """
+        self.shares = dict(GOVLE_TRAFFIC_SHARES)
+        if shares:
+            unknown = set(shares) - set(GOVLE_TRAFFIC_SHARES)
+            if unknown:
+                raise ValueError(f"unknown weighted traffic classes {', '.join(sorted(unknown))}")
+            self.shares.update(shares)
+        self.on_expired = on_expired
+        self.__queues = {c: collections.deque() for c in TRAFFIC_CLASSES}
+        self.__credits = dict(self.shares)
+        # Served once every class is empty, used to stop the worker
+        self.__final = None
+        # Class of the unit being sent, served before anything else
+        self.__pinned = None
+        self.__size = 0
+        self.__unfinished = 0
+        self.__ready = asyncio.Event()
+        self.__finished = asyncio.Event()
+        self.__finished.set()
+
+    def qsize(self) -> int:
+        """Returns the number of queued entries"""
+        return self.__size
+
+    def empty(self) -> bool:
+        return self.__size == 0
+
+    def depth(self, traffic: str) -> int:
+        """Returns the number of queued entries of one class"""
+        return len(self.__queues[traffic])
+
+    def put_nowait(self, work) -> None:
+        """Queue work at the end of its traffic class"""
+        self.__queues[work.traffic].append(work)
+        self.__added()
+
+    def put_final(self, work) -> None:
+        """Queue work to be returned after everything else"""
+        self.__final = work
+        self.__added()
+
+    def __added(self):
+        self.__size += 1
+        self.__unfinished += 1
+        self.__finished.clear()
+        self.__ready.set()
+
+    async def get(self, timeout=None):
+        """Wait for and return the next entry to send
+            :param timeout: optional seconds to wait, None is returned once
+                            they passed without an entry
+        """
+        until = None if timeout is None else time.monotonic() + timeout
+        while True:
+            work = self.__next()
+            if work is not None:
+                return work
+            self.__ready.clear()
+            if until is None:
+                await self.__ready.wait()
+                continue
+            try:
+                await asyncio.wait_for(self.__ready.wait(), until - time.monotonic())
+            except asyncio.TimeoutError:
+                return None
+
+    def task_done(self) -> None:
+        """Mark one entry returned by get as processed"""
+        self.__unfinished -= 1
+        if self.__unfinished <= 0:
+            self.__finished.set()
+
+    async def join(self) -> None:
+        """Wait until every queued entry was processed"""
+        await self.__finished.wait()
+
+    def __next(self):
+        """Pick the next entry, None if nothing is queued"""
+        if self.__pinned is not None:
+            work = self.__pop(self.__pinned)
+            if work is not None:
+                return work
+            # The rest of the unit expired
+            self.__pinned = None
+
+        for traffic in TRAFFIC_STRICT:
+            work = self.__pop(traffic)
+            if work is not None:
+                return work
+
+        waiting = [c for c in self.shares if self.__live(c)]
+        if waiting:
+            if all(self.__credits[c] <= 0 for c in waiting):
+                self.__credits = dict(self.shares)
+            for traffic in waiting:
+                if self.__credits[traffic] > 0:
+                    self.__credits[traffic] -= 1
+                    return self.__pop(traffic)
+
+        if self.__final is not None and self.__size == 1:
+            work, self.__final = self.__final, None
+            self.__size -= 1
+            return work
+        return None
+
+    def __live(self, traffic) -> bool:
+        """Drop expired entries at the head of a class, true if any remain"""
+        queue = self.__queues[traffic]
+        if queue:
+            now = time.monotonic()
+            while queue and queue[0].deadline is not None and queue[0].deadline < now:
+                work = queue.popleft()
+                self.__size -= 1
+                if self.on_expired is not None:
+                    self.on_expired(work)
+                self.task_done()
+        return bool(queue)
+
+    def __pop(self, traffic):
+        """Returns the oldest live entry of a class, or None"""
+        if not self.__live(traffic):
+            return None
+        self.__size -= 1
+        work = self.__queues[traffic].popleft()
+        self.__pinned = traffic if work.unit_end is False else None
+        return work
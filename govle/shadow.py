@@ -0,0 +1,141 @@
+"""
+@file shadow.py
+@brief Last known device state, kept from successful writes
+"""
+import json
+import os
+import time
+
+from govle import gov
+
+GOVLE_SHADOW_FILE = "govle_state.json"
+
+
+class Shadow(object):
+    """State shadow for one strip
+        Le applies every packet it transmits successfully. Values restored
+        from disk or learned before the last reconnect can be read but are
+        not trusted to suppress writes, since the strip may have been changed
+        by another controller or lost power in the meantime.
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self.power = None
+        self.brightness = None
+        self.gradient = None
+        self.color = None
+        self.segments = [None] * gov.SEGMENT_COUNT
+        self.updated = None
+        # Fields confirmed by writes on the current connection. Segments
+        # are tracked individually as ("segment", index).
+        self.__confirmed = set()
+
+    def apply(self, packet) -> None:
+        """Update the shadow from a packet the device acknowledged"""
+        kind, value = gov.decode(packet.get_payload(), packet.pm)
+        if kind in ("power", "brightness", "gradient"):
+            setattr(self, kind, value)
+            self.__confirmed.add(kind)
+        elif kind == "color":
+            self.color = value
+            self.segments = [value] * gov.SEGMENT_COUNT
+            self.__confirmed.update(("segment", i) for i in range(gov.SEGMENT_COUNT))
+        elif kind == "segment":
+            rgb, mask = value
+            for i in range(gov.SEGMENT_COUNT):
+                if mask & (1 << i):
+                    self.segments[i] = rgb
+                    self.__confirmed.add(("segment", i))
+        elif kind == "diy":
+            self.invalidate_colors()
+            return
+        else:
+            return
+        self.updated = time.time()
+
+    def is_redundant(self, packet) -> bool:
+        """Returns true if packet would not change the confirmed state"""
+        kind, value = gov.decode(packet.get_payload(), packet.pm)
+        if kind in ("power", "brightness", "gradient"):
+            return kind in self.__confirmed and getattr(self, kind) == value
+        if kind == "color":
+            return self.__segments_are(value, 0xFFFF)
+        if kind == "segment":
+            return self.__segments_are(*value)
+        return False
+
+    def __segments_are(self, rgb, mask):
+        """Returns true if every masked segment is confirmed to show rgb"""
+        for i in range(gov.SEGMENT_COUNT):
+            if mask & (1 << i):
+                if ("segment", i) not in self.__confirmed or self.segments[i] != rgb:
+                    return False
+        return True
+
+    def invalidate(self) -> None:
+        """Stop trusting the current values, e.g. after a reconnect"""
+        self.__confirmed.clear()
+
+    def invalidate_colors(self) -> None:
+        """Stop trusting segment colors, e.g. after starting a DIY effect"""
+        self.__confirmed = {f for f in self.__confirmed if not isinstance(f, tuple)}
+
+    def to_dict(self) -> dict:
+        """Returns a JSON friendly copy of the state"""
+        return {
+            "power": self.power,
+            "brightness": self.brightness,
+            "gradient": self.gradient,
+            "color": self.color,
+            "segments": list(self.segments),
+            "updated": self.updated,
+        }
+
+    @classmethod
+    def from_dict(cls, address: str, state: dict):
+        """Restore a shadow saved with to_dict, nothing is confirmed"""
+        shadow = cls(address)
+        shadow.power = state.get("power")
+        shadow.brightness = state.get("brightness")
+        shadow.gradient = state.get("gradient")
+        shadow.color = tuple(state["color"]) if state.get("color") else None
+        segments = state.get("segments") or []
+        if len(segments) == gov.SEGMENT_COUNT:
+            shadow.segments = [tuple(rgb) if rgb else None for rgb in segments]
+        shadow.updated = state.get("updated")
+        return shadow
+
+
+class ShadowStore(object):
+    """Shadows for every device, persisted as one JSON file"""
+
+    def __init__(self, path=GOVLE_SHADOW_FILE):
+        self.path = path
+        self.shadows = {}
+        self.load()
+
+    def load(self) -> None:
+        """Read saved shadows, a missing or corrupt file starts empty"""
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for address, state in saved.items():
+            self.shadows[address] = Shadow.from_dict(address, state)
+
+    def save(self) -> None:
+        """Write all shadows, replacing the file atomically"""
+        state = {address: s.to_dict() for address, s in self.shadows.items()}
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def get(self, address: str) -> Shadow:
+        """Returns the shadow for address, creating it if required"""
+        shadow = self.shadows.get(address)
+        if shadow is None:
+            shadow = self.shadows[address] = Shadow(address)
+        return shadow
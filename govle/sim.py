@@ -0,0 +1,258 @@
+"""
+@file sim.py
+@brief In-process simulated H6127 and transport
+
+    network = SimNetwork(latency=0.02, jitter=0.01, drop_rate=0.01)
+    async with Govle("SIM:01", transport_factory=network) as gle:
+        await gle.set_power(True)
+    print(network.devices["SIM:01"].power)
+"""
+import asyncio
+import random
+import time
+from functools import reduce
+from operator import xor
+
+from govle import diy, gov, transport
+from govle.gov import H6127_PROTOCOL_MAP
+
+
+class SimLinkError(Exception):
+    """Simulated GATT failure"""
+
+
+class SimDevice(object):
+    """Simulated H6127 that decodes packets and tracks strip state"""
+
+    def __init__(self, address: str, pm=H6127_PROTOCOL_MAP):
+        self.address = address
+        self.pm = pm
+        # Set to False to make the device refuse connects and drop links
+        self.reachable = True
+        self.power = False
+        self.brightness = 0
+        self.gradient = False
+        self.color = (0, 0, 0)
+        self.segments = [(0, 0, 0)] * gov.SEGMENT_COUNT
+        self.diy = False
+        # (palette, style, speed) of the last uploaded DIY effect
+        self.effect = None
+        self.received = 0
+        self.keep_alives = 0
+        self.queries = 0
+        self.bad_checksums = 0
+        self.unknown = 0
+        self.__diy_data = None
+
+    def state(self) -> dict:
+        """Returns the current strip state"""
+        return {
+            "power": self.power,
+            "brightness": self.brightness,
+            "gradient": self.gradient,
+            "color": self.color,
+            "segments": list(self.segments),
+            "diy": self.diy,
+            "effect": self.effect,
+        }
+
+    def receive(self, payload) -> bool:
+        """Decode one packet and apply it
+            :param payload: 20 packet bytes
+            :return bool True if the packet was valid
+        """
+        payload = bytes(payload)
+        self.received += 1
+        if len(payload) != self.pm["packet_length"] or reduce(xor, payload[:-1], 0) != payload[-1]:
+            self.bad_checksums += 1
+            return False
+
+        kind, value = gov.decode(payload, self.pm)
+        if kind == "keep_alive":
+            self.keep_alives += 1
+        elif kind == "power":
+            self.power = value
+        elif kind == "brightness":
+            self.brightness = value
+        elif kind == "gradient":
+            self.gradient = value
+        elif kind == "color":
+            self.color = value
+            self.segments = [value] * gov.SEGMENT_COUNT
+            self.diy = False
+        elif kind == "segment":
+            rgb, mask = value
+            for i in range(gov.SEGMENT_COUNT):
+                if mask & (1 << i):
+                    self.segments[i] = rgb
+            self.diy = False
+        elif kind == "diy":
+            self.__receive_diy(payload)
+        else:
+            self.unknown += 1
+        return True
+
+    def query(self, payload):
+        """Answer a status query the way the device notifies its reply
+            :param payload: 20 query bytes
+            :return 20 reply bytes, None if the query is not understood
+        """
+        payload = bytes(payload)
+        self.queries += 1
+        query = self.pm["query"]
+        if len(payload) != self.pm["packet_length"] or payload[0] != query["indicator"] \
+                or reduce(xor, payload[:-1], 0) != payload[-1]:
+            return None
+        commands = self.pm["commands"]
+        constants = self.pm["constants"]
+        command = payload[1]
+        if command == commands["power"]:
+            data = [constants[self.power]]
+        elif command == commands["brightness"]:
+            data = [self.brightness]
+        elif command == commands["gradient"]:
+            data = [constants[self.gradient]]
+        elif command == query["segments"] and 1 <= payload[2] <= gov.SEGMENT_COUNT // query["page_size"]:
+            first = (payload[2] - 1) * query["page_size"]
+            data = [payload[2]]
+            for rgb in self.segments[first:first + query["page_size"]]:
+                data += [self.brightness] + list(rgb)
+        else:
+            return None
+        reply = bytearray(self.pm["packet_length"])
+        reply[:2 + len(data)] = bytes([query["indicator"], command] + data)
+        reply[-1] = reduce(xor, reply[:-1], 0)
+        return bytes(reply)
+
+    def __receive_diy(self, payload):
+        """Collect DIY data packets between the start and end markers"""
+        if payload[0] == self.pm["indicator"]:
+            # DIY command, starts the uploaded effect
+            self.diy = self.effect is not None
+            return
+        number = payload[2]
+        if number == diy.DIY_START:
+            self.__diy_data = []
+        elif number == diy.DIY_END:
+            if self.__diy_data is not None:
+                self.effect = diy.decode(b"".join(self.__diy_data))
+            self.__diy_data = None
+        elif self.__diy_data is not None:
+            self.__diy_data.append(payload[3:-1])
+
+
+class SimTransport(transport.Transport):
+    """Transport to a SimDevice with injected latency, jitter and failures"""
+
+    def __init__(self, address, device, latency=0.0, jitter=0.0, drop_rate=0.0,
+                 disconnect_rate=0.0, connect_latency=0.0, idle_timeout=None, seed=None):
+        """Create a new simulated link
+            :param device: SimDevice receiving the packets
+            :param latency: seconds per acknowledged write
+            :param jitter: extra random seconds per write, uniform [0, jitter]
+            :param drop_rate: probability a write is lost
+            :param disconnect_rate: probability a write drops the link
+            :param connect_latency: seconds per connect
+            :param idle_timeout: optional seconds without a write after
+                                 which the device drops the link
+            :param seed: optional random seed
+        """
+        super().__init__(address)
+        self.device = device
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.disconnect_rate = disconnect_rate
+        self.connect_latency = connect_latency
+        self.idle_timeout = idle_timeout
+        self.connects = 0
+        self.idle_drops = 0
+        self.__random = random.Random(seed)
+        self.__connected = False
+        self.__last_write = time.monotonic()
+
+    @property
+    def is_connected(self) -> bool:
+        if self.__connected and self.idle_timeout is not None:
+            if time.monotonic() - self.__last_write > self.idle_timeout:
+                self.__connected = False
+                self.idle_drops += 1
+        return self.__connected
+
+    async def connect(self) -> bool:
+        await asyncio.sleep(self.connect_latency)
+        if not self.device.reachable:
+            raise SimLinkError(f"{self.address} not found")
+        self.connects += 1
+        self.__connected = True
+        self.__last_write = time.monotonic()
+        return True
+
+    async def disconnect(self) -> None:
+        self.__connected = False
+
+    async def write(self, characteristic: str, payload: bytes, response=True) -> None:
+        if not self.is_connected:
+            raise SimLinkError(f"{self.address} not connected")
+        if response:
+            await asyncio.sleep(self.latency + self.__random.uniform(0, self.jitter))
+        else:
+            # Unacknowledged writes only yield, the host does not wait
+            await asyncio.sleep(0)
+        if not self.device.reachable or self.__random.random() < self.disconnect_rate:
+            self.__connected = False
+            raise SimLinkError(f"{self.address} disconnected")
+        if self.__random.random() < self.drop_rate:
+            if response:
+                raise SimLinkError(f"{self.address} write timed out")
+            return
+        self.__last_write = time.monotonic()
+        self.device.receive(payload)
+
+    async def query(self, characteristic: str, payload: bytes, prefix: bytes) -> bytes:
+        # A query is an acknowledged write that fails the same ways
+        if not self.is_connected:
+            raise SimLinkError(f"{self.address} not connected")
+        await asyncio.sleep(self.latency + self.__random.uniform(0, self.jitter))
+        if not self.device.reachable or self.__random.random() < self.disconnect_rate:
+            self.__connected = False
+            raise SimLinkError(f"{self.address} disconnected")
+        if self.__random.random() < self.drop_rate:
+            raise SimLinkError(f"{self.address} write timed out")
+        self.__last_write = time.monotonic()
+        reply = self.device.query(payload)
+        if reply is None or not reply.startswith(prefix):
+            raise asyncio.TimeoutError(f"{self.address} did not answer")
+        return reply
+
+
+class SimNetwork(object):
+    """Transport factory with one persistent SimDevice per address
+        Pass an instance as transport_factory to Le, Govle, GovleGroup or
+        DeviceManager. Reconnects get a fresh SimTransport to the same device.
+    """
+
+    def __init__(self, **link_options):
+        """Create a new network
+            :param link_options: SimTransport keyword arguments for every link
+        """
+        self.link_options = link_options
+        self.devices = {}
+        self.transports = []
+
+    def __call__(self, address: str) -> SimTransport:
+        device = self.devices.get(address)
+        if device is None:
+            device = self.devices[address] = SimDevice(address)
+        options = dict(self.link_options)
+        if options.get("seed") is not None:
+            # Every link gets its own repeatable random stream
+            options["seed"] += len(self.transports)
+        link = SimTransport(address, device, **options)
+        self.transports.append(link)
+        return link
+
+    @property
+    def connects(self) -> int:
+        """Returns the number of connects across all links"""
+        return sum(t.connects for t in self.transports)
@@ -0,0 +1,136 @@
+"""
+@file throttle.py
+@brief Async transmit rate limiting and flow control
+"""
+import asyncio
+import time
+
+
+class NullLimiter(object):
+    """Rate limiter that never waits"""
+    rate = None
+
+    async def acquire(self) -> None:
+        """Returns immediately"""
+
+    def on_success(self) -> None:
+        """Ignored"""
+
+    def on_error(self) -> None:
+        """Ignored"""
+
+
+class TokenBucket(object):
+    """Token bucket limiter with an adaptive rate
+        limiter = TokenBucket(rate=20, burst=5)
+        await limiter.acquire()
+
+    Tokens refill at rate per second up to burst and each packet costs one
+    token. A write error multiplies the rate by backoff, every success adds
+    recovery packets per second back until max_rate is reached again.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, min_rate=None, backoff=0.5, recovery=None):
+        """Create a new token bucket
+            :param rate: sustained packets per second
+            :param burst: maximum packets sent back to back
+            :param min_rate: lowest rate errors can push us to, default rate/10
+            :param backoff: rate multiplier applied on error
+            :param recovery: packets per second regained per success, default rate/100
+        """
+        assert rate > 0, "rate must be positive"
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate if min_rate is not None else rate / 10
+        self.backoff = backoff
+        self.recovery = recovery if recovery is not None else rate / 100
+        self.__tokens = float(burst)
+        self.__stamp = time.monotonic()
+        # Keeps waiters in FIFO order when one bucket is shared
+        self.__lock = asyncio.Lock()
+
+    def __refill(self):
+        """Add the tokens earned since the last refill"""
+        now = time.monotonic()
+        self.__tokens = min(self.burst, self.__tokens + (now - self.__stamp) * self.rate)
+        self.__stamp = now
+
+    async def acquire(self) -> None:
+        """Wait until a packet may be sent"""
+        async with self.__lock:
+            self.__refill()
+            if self.__tokens < 1:
+                await asyncio.sleep((1 - self.__tokens) / self.rate)
+                self.__refill()
+            self.__tokens -= 1
+
+    def on_success(self) -> None:
+        """Slowly raise the rate back towards max_rate"""
+        self.rate = min(self.max_rate, self.rate + self.recovery)
+
+    def on_error(self) -> None:
+        """Cut the rate after a failed write"""
+        self.rate = max(self.min_rate, self.rate * self.backoff)
+
+
+class AdaptiveWindow(object):
+    """In-flight window for unacknowledged writes
+        Up to size state writes go out without response before Le asks the
+        device for the states they set and rewrites, with response, only
+        those that did not arrive. Every window found intact grows the size
+        by one, every lost write, error or disconnect halves it (AIMD).
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=32):
+        """Create a new window
+            :param initial: starting number of packets per confirmation
+            :param minimum: smallest window, 1 means every write is acknowledged
+            :param maximum: largest window
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.size = max(minimum, min(maximum, initial))
+
+    def on_confirm(self) -> None:
+        """Grow after a window was confirmed"""
+        self.size = min(self.maximum, self.size + 1)
+
+    def on_error(self) -> None:
+        """Shrink after a failed write"""
+        self.size = max(self.minimum, self.size // 2)
+
+
+class KeepAliveInterval(object):
+    """Idle time after which a keep-alive is sent
+        Every keep-alive the link survives stretches the interval by growth.
+        A disconnect after the link was idle for t seconds means the device
+        gives up sooner than t, so the interval drops to t * backoff and is
+        never grown past that again.
+    """
+
+    def __init__(self, initial=2.0, minimum=0.5, maximum=30.0, growth=1.1, backoff=0.5):
+        """Create a new interval
+            :param initial: starting idle seconds before a keep-alive
+            :param minimum: shortest interval
+            :param maximum: longest interval
+            :param growth: interval multiplier per survived keep-alive
+            :param backoff: fraction of the fatal idle time to fall back to
+        """
+        self.minimum = minimum
+        self.ceiling = maximum
+        self.growth = growth
+        self.backoff = backoff
+        self.interval = max(minimum, min(maximum, initial))
+
+    def on_survived(self) -> None:
+        """Grow after a keep-alive went out on a live link"""
+        self.interval = min(self.ceiling, self.interval * self.growth)
+
+    def on_disconnect(self, idle: float) -> None:
+        """Shrink after the link dropped following idle seconds without traffic"""
+        if idle < self.minimum:
+            # Dropped while busy, not an idle timeout
+            return
+        self.ceiling = max(self.minimum, min(self.ceiling, idle * self.backoff))
+        self.interval = min(self.interval, self.ceiling)
@@ -0,0 +1,96 @@
+"""
+@file transport.py
+@brief Pluggable links between Le and a device
+"""
+import asyncio
+from abc import ABC, abstractmethod
+
+from govle import gov
+
+GOVLE_QUERY_TIMEOUT = 1.0 # seconds to wait for the reply to a status query
+
+
+class Transport(ABC):
+    """Link to one device
+        Le creates a transport per connection through a factory taking the
+        BLE address, so anything with this interface can stand in for a
+        real BLE client. Subclasses must implement every abstract method,
+        an incomplete one can not be created.
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+
+    @property
+    @abstractmethod
+    def is_connected(self) -> bool:
+        """Returns true if the link is up"""
+
+    @abstractmethod
+    async def connect(self) -> bool:
+        """Open the link"""
+
+    @abstractmethod
+    async def disconnect(self) -> None:
+        """Close the link"""
+
+    @abstractmethod
+    async def write(self, characteristic: str, payload: bytes, response=True) -> None:
+        """Write payload to characteristic
+            :param response: bool True to wait for the device to acknowledge
+        """
+
+    @abstractmethod
+    async def query(self, characteristic: str, payload: bytes, prefix: bytes) -> bytes:
+        """Write a status query with response and return the device's reply
+            :param prefix: bytes the reply starts with, see gov.reply_prefix
+            :return 20 reply bytes
+            :raises asyncio.TimeoutError if the device does not answer
+        """
+
+
+class BleakTransport(Transport):
+    """Transport over a bleak BleakClient"""
+
+    def __init__(self, address: str):
+        super().__init__(address)
+        # Imported here so simulated links work on hosts without bleak
+        from bleak import BleakClient
+        self.__client = BleakClient(address)
+        self.__notifying = False
+        # (prefix, future) of the query waiting for its reply
+        self.__waiter = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self.__client.is_connected
+
+    async def connect(self) -> bool:
+        await self.__client.connect()
+        return self.__client.is_connected
+
+    async def disconnect(self) -> None:
+        await self.__client.disconnect()
+
+    async def write(self, characteristic: str, payload: bytes, response=True) -> None:
+        await self.__client.write_gatt_char(characteristic, payload, response=response)
+
+    async def query(self, characteristic: str, payload: bytes, prefix: bytes) -> bytes:
+        if not self.__notifying:
+            await self.__client.start_notify(gov.GOVLE_NOTIFY_CHARACTERISTIC, self.__on_notify)
+            self.__notifying = True
+        reply = asyncio.get_running_loop().create_future()
+        self.__waiter = (prefix, reply)
+        try:
+            await self.__client.write_gatt_char(characteristic, payload, response=True)
+            return await asyncio.wait_for(reply, GOVLE_QUERY_TIMEOUT)
+        finally:
+            self.__waiter = None
+
+    def __on_notify(self, _, data):
+        """Hand a notification to the query it answers, others are ignored"""
+        if self.__waiter is None:
+            return
+        prefix, reply = self.__waiter
+        if not reply.done() and bytes(data[:len(prefix)]) == prefix:
+            reply.set_result(bytes(data))
@@ -0,0 +1,108 @@
+"""
+@file vcolor.py
+@brief Vectorized color math on NumPy arrays
+
+RGB arrays are uint8 with shape (..., 3). HSV arrays are float with every
+channel in [0, 1]. Functions broadcast over any leading dimensions, so a
+whole animation timeline of shape (frames, segments, 3) is handled in one
+call instead of one tuple at a time.
+"""
+import numpy as np
+
+from govle.gov import SEGMENT_COUNT
+
+
+def as_rgb(colors) -> np.ndarray:
+    """Convert RGB tuples or arrays to a clipped uint8 array"""
+    return np.clip(np.rint(np.asarray(colors, dtype=np.float64)), 0, 255).astype(np.uint8)
+
+def rgb_to_hsv(rgb) -> np.ndarray:
+    """Convert uint8 RGB to float HSV"""
+    rgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    maxc = rgb.max(axis=-1)
+    minc = rgb.min(axis=-1)
+    delta = maxc - minc
+    safe = np.where(delta == 0, 1.0, delta)
+    rc = (maxc - r) / safe
+    gc = (maxc - g) / safe
+    bc = (maxc - b) / safe
+    h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = np.where(delta == 0, 0.0, (h / 6.0) % 1.0)
+    s = np.where(maxc == 0, 0.0, delta / np.where(maxc == 0, 1.0, maxc))
+    return np.stack([h, s, maxc], axis=-1)
+
+def hsv_to_rgb(hsv) -> np.ndarray:
+    """Convert float HSV to uint8 RGB"""
+    hsv = np.asarray(hsv, dtype=np.float64)
+    h, s, v = hsv[..., 0] % 1.0, hsv[..., 1], hsv[..., 2]
+    h6 = h * 6.0
+    i = np.floor(h6).astype(np.int64) % 6
+    f = h6 - np.floor(h6)
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    r = np.choose(i, [v, q, p, p, t, v])
+    g = np.choose(i, [t, v, v, q, p, p])
+    b = np.choose(i, [p, p, t, v, v, q])
+    return as_rgb(np.stack([r, g, b], axis=-1) * 255.0)
+
+def scale(rgb, brightness=1.0, gamma=1.0) -> np.ndarray:
+    """Scale RGB by brightness and apply gamma correction
+        :param rgb: uint8 RGB array
+        :param brightness: scalar or array broadcastable to rgb[..., 0]
+        :param gamma: exponent applied to the normalized channels
+    """
+    normalized = np.asarray(rgb, dtype=np.float64) / 255.0
+    if gamma != 1.0:
+        normalized = normalized ** gamma
+    brightness = np.asarray(brightness, dtype=np.float64)[..., np.newaxis]
+    return as_rgb(normalized * brightness * 255.0)
+
+def gradient(start, end, segments=SEGMENT_COUNT) -> np.ndarray:
+    """Linear RGB gradient across segments
+        :param start: RGB at the first segment, or an array of them
+        :param end: RGB at the last segment, or an array of them
+        :return uint8 array of shape (..., segments, 3)
+    """
+    start = np.asarray(start, dtype=np.float64)[..., np.newaxis, :]
+    end = np.asarray(end, dtype=np.float64)[..., np.newaxis, :]
+    weights = np.linspace(0.0, 1.0, segments)[:, np.newaxis]
+    return as_rgb(start + (end - start) * weights)
+
+def rainbow(frames, segments=SEGMENT_COUNT, cycles=1.0, saturation=1.0, value=1.0) -> np.ndarray:
+    """Hue wheel spread over the strip and rotated over time
+        :param frames: number of frames in the timeline
+        :param cycles: full hue rotations over the timeline
+        :return uint8 array of shape (frames, segments, 3)
+    """
+    offsets = np.arange(segments) / segments
+    shift = np.arange(frames)[:, np.newaxis] * (cycles / max(frames, 1))
+    hue = offsets[np.newaxis, :] + shift
+    hsv = np.stack(np.broadcast_arrays(hue, saturation, value), axis=-1)
+    return hsv_to_rgb(hsv)
+
+def complementary(rgb) -> np.ndarray:
+    """Returns the complement of every color, same as 0xFFFFFF - color"""
+    return 255 - as_rgb(rgb)
+
+def random_complementary_pairs(count, rng=None):
+    """Generate random colors and their complements
+        :param count: number of pairs
+        :param rng: optional numpy Generator
+        :return tuple of two uint8 arrays of shape (count, 3)
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    colors = rng.integers(0, 255, size=(count, 3), dtype=np.uint8)
+    return colors, complementary(colors)
+
+def palette(count, saturation=1.0, value=1.0, offset=0.0) -> np.ndarray:
+    """Evenly spaced hues
+        :return uint8 array of shape (count, 3)
+    """
+    hue = offset + np.arange(count) / max(count, 1)
+    return hsv_to_rgb(np.stack(np.broadcast_arrays(hue, saturation, value), axis=-1))
+
+def to_frames(timeline) -> list:
+    """Convert a (frames, segments, 3) array into nested lists of ints for Govle.show_frame"""
+    return as_rgb(timeline).tolist()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import signal
+from govle import daemon, discovery, manager, metrics, shadow, sim, throttle
+from govle.logging import logger, logging, set_trace, setup_logging
+
+from config import *
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="govle background daemon")
+    parser.add_argument("--socket", help="Unix socket path", default=daemon.GOVLE_SOCKET)
+    parser.add_argument("--preconnect", help="Connect every device at startup", action="store_true")
+    parser.add_argument("--sim", help="Use simulated devices instead of BLE", action="store_true")
+    parser.add_argument("--pipeline", help="Pipeline writes without response", action="store_true")
+    parser.add_argument("--debug", help="Log every command", action="store_true")
+    parser.add_argument("--trace", help="Log one packet in every N, 0 for none", type=int)
+    args = parser.parse_args()
+    setup_logging(logging.DEBUG if args.debug else logging.INFO)
+    if args.trace is not None:
+        set_trace(args.trace)
+
+    metrics.REGISTRY.enable()
+    registry = discovery.DeviceRegistry()
+    device_manager = manager.DeviceManager(
+        devices,
+        transport_factory=sim.SimNetwork() if args.sim else None,
+        window_factory=throttle.AdaptiveWindow if args.pipeline else None,
+        store=None if args.sim else shadow.ShadowStore(),
+        registry=registry)
+    server = daemon.GovleDaemon(device_manager, groups, args.socket)
+    await server.start()
+    scanner = None
+    if scan_interval and not args.sim:
+        scanner = discovery.Scanner(registry, scan_interval)
+        scanner.start()
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+    await stopping.wait()
+
+    logger.info("daemon stopping")
+    if scanner is not None:
+        await scanner.stop()
+    await server.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
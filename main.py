@@ -3,71 +3,110 @@
 import argparse
 import asyncio
 import sys
-from govle import govle, color
-from govle.logging import logger, logging
+from govle import commands, daemon, discovery
+from govle.logging import logger, logging, set_trace, setup_logging
 
 from config import *
 
 logging.getLogger('govle').setLevel(logging.DEBUG)
 
-
 async def main():
     parser = argparse.ArgumentParser("description='govle LED strip tool'")
-    parser.add_argument("device", help="Which device to control", choices=devices.keys())
+    parser.add_argument("device", help="Which device or group to control, a configured or discovered name or an address")
     parser.add_argument('-o', "--operation", help="Operation to perform", default="discover")
     parser.add_argument('-l', "--level", help="Brightness level, 0-255", type=int)
     parser.add_argument('-r', "--rgb", nargs=3, type=int)
+    parser.add_argument("--scene", help="Scene file to replay")
+    parser.add_argument("--audio", help="WAV file to light in time with, for the music operation")
+    parser.add_argument("--record", help="Record the packets sent to a scene file, implies --direct")
+    parser.add_argument("--sim", help="Use a simulated device instead of BLE", action="store_true")
+    parser.add_argument("--pipeline", help="Pipeline writes without response", action="store_true")
+    parser.add_argument("--direct", help="Connect directly even if the daemon is running", action="store_true")
+    parser.add_argument("--socket", help="Daemon socket path", default=daemon.GOVLE_SOCKET)
+    parser.add_argument("--trace", help="Log one packet in every N, 0 for none", type=int)
     args = parser.parse_args()
+    if args.trace is not None:
+        set_trace(args.trace)
 
-    if args.operation == "brightness" and args.level is None:
-        parser.error("brightness operation requires --level parameter")
-    elif args.operation == "color" and args.rgb is None:
-        parser.error("color operation requires --rgb parameter")
+    # File operand of the operations that take one
+    path = args.audio if args.operation == "music" else args.scene
+    error = commands.validate(args.operation, args.level, args.rgb, path)
+    if error is not None:
+        parser.error(error)
+    if args.record and args.device in groups:
+        parser.error("--record needs a single device")
+    setup_logging()
 
     device_name = args.device
     operation = args.operation
     level = args.level
     rgb = args.rgb
 
+    registry = discovery.DeviceRegistry()
     if operation == "discover":
         logger.info("Discovering devices...")
-        await govle.Govle.discover()
+        for found in await discovery.scan(registry):
+            print(found)
+        registry.save()
         return
 
-    async with govle.Govle(devices[device_name]) as gle:
-        if operation == "on":
-            await gle.set_power(True)
-        elif operation == "off":
-            await gle.set_power(False)
-        elif operation == "gradient-on":
-            await gle.set_gradient(True)
-        elif operation == "gradient-off":
-            await gle.set_gradient(False)
-        elif operation == "brightness":
-            await gle.set_brightness(level)
-        elif operation == "color":
-            await gle.set_color(rgb)
-        elif operation == "slide":
-            forward = True
-            back, spot = color.get_random_complementary_pair()
-            for _ in range(5):
-                await gle.slide(back, spot, hold=0.1, forward=forward)
-                forward = not forward
-        elif operation == "diy":
-            await gle.diy()
-        elif operation == "all":
-            await gle.set_power(True)
-            await gle.set_gradient(True)
-            await gle.set_gradient(False)
-            for b in range(10, 251, 10):
-                await gle.set_brightness(b)
-            for _ in range(10):
-                await gle.set_color(color.get_random_color())
-            back, spot = color.get_random_complementary_pair()
-            await gle.slide(back, spot, hold=0.1)
-            await gle.set_power(False)
+    def resolve(name):
+        return registry.address_for(devices.get(name) or name)
+
+    if device_name not in groups and device_name not in devices and not discovery.is_address(resolve(device_name)):
+        parser.error(f"unknown device '{device_name}', run a discover operation or add it to config.py")
+
+    if not (args.direct or args.sim or args.record):
+        timeout = daemon.client_timeout(operation)
+        try:
+            response = await daemon.request(daemon.format_command(device_name, operation, level, rgb, path),
+                                            args.socket, timeout)
+        except asyncio.TimeoutError:
+            # The daemon may still be running the command, do not run it twice
+            print(f"err no answer from the daemon within {timeout}s")
+            return 1
+        except ConnectionResetError:
+            print(f"err the daemon on {args.socket} hung up")
+            return 1
+        except OSError as ex:
+            # No daemon, or one this user may not talk to, such as another
+            # user's on the shared /tmp socket
+            logger.debug(f"no usable daemon on {args.socket} ({ex}), connecting directly")
         else:
-            parser.error(f"unknown operation '{operation}'")
+            print(response)
+            return 0 if response.startswith("ok") else 1
+
+    # Only a direct connection needs the device stack
+    from govle import color, govle, group, shadow, sim, throttle
+
+    transport_factory = sim.SimNetwork() if args.sim else None
+    window_factory = throttle.AdaptiveWindow if args.pipeline else None
+    store = shadow.ShadowStore()
+
+    def device(address):
+        window = window_factory() if window_factory else None
+        return govle.Govle(address, transport_factory=transport_factory, window=window, state=store.get(address))
+
+    # Effects pick their colors once so every group member matches
+    back, spot = color.get_random_complementary_pair()
+
+    if device_name in devices or device_name not in groups:
+        async with device(resolve(device_name)) as gle:
+            if args.record:
+                with gle.record(args.record) as recorder:
+                    await commands.run(gle, operation, level, rgb, back, spot, path)
+                logger.info(f"recorded {recorder.count} packets to {args.record}")
+            else:
+                await commands.run(gle, operation, level, rgb, back, spot, path)
+    else:
+        members = [device(resolve(name)) for name in groups[device_name]]
+        async with group.GovleGroup(members) as grp:
+            results = await grp.fan_out(lambda gle: commands.run(gle, operation, level, rgb, back, spot, path))
+            for result in results.values():
+                logger.info(f"{result}")
+
+    if not args.sim:
+        store.save()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    sys.exit(asyncio.run(main()))
@@ -1,27 +1,236 @@
 #!/usr/bin/env python3
-from quart import Quart, render_template, request
-from govle import color,govle
+import asyncio
+from quart import Quart, Response, render_template, request, websocket
+from govle import color, discovery, govle, manager, metrics, shadow
+from govle.logging import setup_logging
 from config import *
 
 app = Quart(__name__)
 
-default_device = devices["office"]
+default_device = "office"
+registry = discovery.DeviceRegistry()
+scanner = discovery.Scanner(registry, scan_interval) if scan_interval else None
+device_manager = manager.DeviceManager(devices, store=shadow.ShadowStore(), registry=registry)
+
+@app.before_serving
+async def startup():
+    setup_logging()
+    metrics.REGISTRY.enable()
+    if scanner is not None:
+        scanner.start()
+    await device_manager.start()
+
+@app.after_serving
+async def shutdown():
+    if scanner is not None:
+        await scanner.stop()
+    await device_manager.stop()
+
+async def group_results(data, command):
+    """Run command on the group named in data
+        :return dict response with per-device results, or an error and 404
+                if no group has that name
+    """
+    name = data['group']
+    members = groups.get(name) if isinstance(name, str) else None
+    if members is None:
+        return {"error": f"unknown group {name!r}"}, 404
+    grp = await device_manager.get_group(members)
+    results = await command(grp)
+    return {"results": {address: result.to_dict() for address, result in results.items()}}
+
+def unknown_device(data):
+    """Returns an error and 404 if data names no known device, otherwise None
+        Without a device field default_device is used.
+    """
+    name = data.get('device', default_device)
+    if not isinstance(name, str) or not device_manager.is_known(name):
+        return {"error": f"unknown device {name!r}"}, 404
+    return None
 
 @app.route("/api/v1/power", methods=["POST"])
 async def api_power():
     data = await request.json
-    async with govle.Govle(default_device) as gle:
-        await gle.set_power(data['state'])
+    if 'group' in data:
+        return await group_results(data, lambda grp: grp.set_power(data['state']))
+    error = unknown_device(data)
+    if error is not None:
+        return error
+    gle = await device_manager.get(data.get('device', default_device))
+    await gle.set_power(data['state'])
     return {}
 
 @app.route("/api/v1/color", methods=["POST"])
 async def api_color():
     data = await request.json
-    async with govle.Govle(default_device) as gle:
-        rgb = color.from_string(data['color'])
-        await gle.set_color(rgb)
+    rgb = color.from_string(data['color'])
+    if 'group' in data:
+        return await group_results(data, lambda grp: grp.set_color(rgb))
+    error = unknown_device(data)
+    if error is not None:
+        return error
+    gle = await device_manager.get(data.get('device', default_device))
+    await gle.set_color(rgb)
     return {}
 
+@app.route("/api/v1/brightness", methods=["POST"])
+async def api_brightness():
+    data = await request.json
+    try:
+        level = int(data['level'])
+    except (KeyError, TypeError, ValueError) as ex:
+        return {"error": f"bad level: {ex}"}, 400
+    if 'group' in data:
+        return await group_results(data, lambda grp: grp.set_brightness(level))
+    error = unknown_device(data)
+    if error is not None:
+        return error
+    gle = await device_manager.get(data.get('device', default_device))
+    await gle.set_brightness(level)
+    return {}
+
+def batch_ops(ops):
+    """Returns ops with "#rrggbb" color strings converted to RGB"""
+    converted = []
+    for op in ops:
+        op = dict(op)
+        value = op.get('value')
+        if op.get('op') == 'color' and isinstance(value, str):
+            op['value'] = color.from_string(value)
+        elif op.get('op') == 'segment' and isinstance(value, dict) and isinstance(value.get('color'), str):
+            op['value'] = dict(value, color=color.from_string(value['color']))
+        converted.append(op)
+    return converted
+
+@app.route("/api/v1/batch", methods=["POST"])
+async def api_batch():
+    data = await request.json
+    try:
+        ops = batch_ops(data['ops'])
+        govle.validate_batch(ops)
+    except (KeyError, TypeError, ValueError) as ex:
+        return {"error": str(ex)}, 400
+    if 'group' in data:
+        return await group_results(data, lambda grp: grp.batch(ops))
+    error = unknown_device(data)
+    if error is not None:
+        return error
+    gle = await device_manager.get(data.get('device', default_device))
+    results = await gle.batch(ops)
+    return {"results": [{"op": op['op'], "success": success} for op, success in zip(ops, results)]}
+
+@app.route("/api/v1/state")
+async def api_state():
+    store = device_manager.store
+    if 'device' in request.args:
+        # Read only, looking up an unknown device must not create a shadow
+        address = device_manager.resolve(request.args['device'])
+        state = store.shadows.get(address)
+        if state is None:
+            return {"error": f"no state for {request.args['device']!r}"}, 404
+        return state.to_dict()
+    names = {address: name for name, address in devices.items()}
+    return {names.get(address, address): s.to_dict() for address, s in store.shadows.items()}
+
+@app.route("/api/v1/metrics")
+async def api_metrics():
+    accept = request.headers.get('Accept', '')
+    if request.args.get('format') == 'prometheus' or accept.startswith('text/plain'):
+        return Response(metrics.REGISTRY.prometheus(), mimetype="text/plain; version=0.0.4")
+    return metrics.REGISTRY.snapshot()
+
+def parse_update(data):
+    """Split one WebSocket message into (device, field, value) updates
+        Segment updates are keyed by their mask so different segments do
+        not replace each other.
+    """
+    device = data.get('device', default_device)
+    if not isinstance(device, str):
+        raise TypeError("device must be a string")
+    updates = []
+    if 'power' in data:
+        updates.append((device, 'power', bool(data['power'])))
+    if 'brightness' in data:
+        updates.append((device, 'brightness', int(data['brightness'])))
+    if 'color' in data:
+        updates.append((device, 'color', color.from_string(data['color'])))
+    if 'frame' in data:
+        updates.append((device, 'frame', [color.from_string(c) for c in data['frame']]))
+    if 'segment' in data:
+        mask = int(data['segment']['mask'])
+        updates.append((device, ('segment', mask), color.from_string(data['segment']['color'])))
+    return updates
+
+async def apply_updates(device, updates):
+    """Send the latest updates for one device and wait for the acks
+        :return dict message for the client with the acknowledged state
+    """
+    if not isinstance(device, str) or not device_manager.is_known(device):
+        return {"device": device, "error": f"unknown device {device!r}"}
+    try:
+        gle = await device_manager.get(device)
+    except Exception as ex:
+        return {"device": device, "error": str(ex)}
+    writes = []
+    for field, value in updates:
+        if field == 'power':
+            writes.append(gle.set_power(value, wait=True))
+        elif field == 'brightness':
+            writes.append(gle.set_brightness(value, wait=True))
+        elif field == 'color':
+            writes.append(gle.set_color(value, wait=True))
+        elif field == 'frame':
+            writes.append(gle.show_frame(value, wait=True))
+        else:
+            writes.append(gle.set_segment_color(value, field[1], wait=True))
+    # gather starts the writes in order, so they are queued in arrival order
+    results = await asyncio.gather(*writes)
+    return {"device": device, "success": all(r is not False for r in results), "state": gle.shadow.to_dict()}
+
+@app.websocket("/api/v1/ws")
+async def api_ws():
+    # Latest value per (device, field) in arrival order. Updates that arrive
+    # while a write is in flight replace each other, so a dragged color
+    # picker sends at most one packet per field per link round trip.
+    latest = {}
+    ready = asyncio.Event()
+
+    async def receive():
+        while True:
+            try:
+                data = await websocket.receive_json()
+                if not isinstance(data, dict):
+                    raise TypeError("update must be a JSON object")
+                updates = parse_update(data)
+            except (KeyError, TypeError, ValueError) as ex:
+                await websocket.send_json({"error": f"bad update: {ex}"})
+                continue
+            for device, field, value in updates:
+                latest.pop((device, field), None)
+                latest[(device, field)] = value
+            ready.set()
+
+    reader = asyncio.ensure_future(receive())
+    try:
+        while True:
+            # Watch the reader too, if it dies nothing would set ready again
+            waiter = asyncio.ensure_future(ready.wait())
+            await asyncio.wait([reader, waiter], return_when=asyncio.FIRST_COMPLETED)
+            if reader.done():
+                waiter.cancel()
+                # Raises whatever ended the reader and closes the socket
+                reader.result()
+                return
+            ready.clear()
+            by_device = {}
+            for (device, field), value in latest.items():
+                by_device.setdefault(device, []).append((field, value))
+            latest.clear()
+            for message in await asyncio.gather(*[apply_updates(d, u) for d, u in by_device.items()]):
+                await websocket.send_json(message)
+    finally:
+        reader.cancel()
+
 @app.route("/")
 async def index():
     return await render_template('index.html')
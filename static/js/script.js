@@ -7,22 +7,68 @@ function post_json(url, data) {
     });
 }
 
+// Live updates go over one WebSocket, the server only forwards the latest
+// value per field at the rate the strip acknowledges. Without a socket every
+// update falls back to a POST.
+var govle_socket = null;
+
+function connect_socket() {
+    var scheme = window.location.protocol === "https:" ? "wss://" : "ws://";
+    var socket = new WebSocket(scheme + window.location.host + "/api/v1/ws");
+    socket.onopen = function() {
+        govle_socket = socket;
+    };
+    socket.onmessage = function(e) {
+        var message = JSON.parse(e.data);
+        if (message.error) {
+            console.warn("govle: " + message.error);
+        }
+    };
+    socket.onclose = function() {
+        govle_socket = null;
+        setTimeout(connect_socket, 2000);
+    };
+}
+
+function send_update(update, url, data) {
+    if (govle_socket !== null && govle_socket.readyState === WebSocket.OPEN) {
+        govle_socket.send(JSON.stringify(update));
+    } else {
+        post_json(url, JSON.stringify(data));
+    }
+}
+
+function send_color(hex) {
+    send_update({"color": hex}, "/api/v1/color", {"color": hex});
+}
+
 $(document).ready(function(){
     var colorPicker = new iro.ColorPicker("#govle_color_basic", {
         width: 320,
         color: "#f00",
         display: "inline-block",
     });
+    connect_socket();
+    colorPicker.on("input:change", function(color) {
+        // Dragging only streams while the socket is up, Apply still works without it
+        if (govle_socket !== null) {
+            send_color(color.hexString);
+        }
+    });
     $("#govle_btn_color").click(function(e) {
         e.preventDefault();
-        post_json("/api/v1/color", JSON.stringify({ "color": colorPicker.color.hexString}))
+        send_color(colorPicker.color.hexString);
     });
     $("#govle_btn_on").click(function(e) {
         e.preventDefault();
-        post_json("/api/v1/power", JSON.stringify({ "state": true}))
+        send_update({"power": true}, "/api/v1/power", {"state": true});
     });
     $("#govle_btn_off").click(function(e) {
         e.preventDefault();
-        post_json("/api/v1/power", JSON.stringify({ "state": false}))
+        send_update({"power": false}, "/api/v1/power", {"state": false});
+    });
+    $("#govle_brightness").on("input", function() {
+        var level = parseInt($(this).val(), 10);
+        send_update({"brightness": level}, "/api/v1/brightness", {"level": level});
     });
-});
\ No newline at end of file
+});